@@ -1,23 +1,25 @@
-import random
 import numpy as np
 
 import config
+import streams
 from order import Order
+from population import PopulationView
 
 
-class AgentZIC:
-    def __init__(self, ttype, tid, nodeid, job):
+class AgentZIC(PopulationView):
+    def __init__(self, ttype, tid, nodeid, job, population=None):
         # All traders
         self.ttype = ttype
         self.tid = tid
         self.nodeid = nodeid
-        self.job = job
+        self.bind(population, job, nodeid)
         self.active = False
         self.order = None
         self.limit = None
         self.price = None
         self.balance = 0.0
-        self.price_hist =[]
+        self.tracker = None  # EqTracker notified of quote changes
+        self.shout = Order(tid, None, None, 1, 'Shout', 0.0)  # reused by get_order for every shout
 
     def __str__(self):
         return '[TID %s type %s nodeid %s limit %s]' \
@@ -35,37 +37,41 @@ class AgentZIC:
             order = None
         else:
             self.active = True
-            status = 'Shout'
-            quoteprice = self.price
-            order = Order(self.tid, self.order.otype, quoteprice, self.order.qty, status, time)
+            # The shout is only valid until the next call, it is the same Order every time
+            order = self.shout
+            order.otype = self.order.otype
+            order.price = self.price
+            order.qty = self.order.qty
+            order.status = 'Shout'
+            order.time = time
 
         return order
 
     def del_order(self):
         self.order = None
         self.active = False
+        if self.tracker is not None:
+            self.tracker.sync(self)
 
     def set_price(self):
         if self.job == 'Buy':
-            quoteprice = random.randint(config.MIN_PRICE, self.limit)
+            quoteprice = streams.get('quotes').randint(config.MIN_PRICE, self.limit)
         else:
-            quoteprice = random.randint(self.limit, config.MAX_PRICE)
+            quoteprice = streams.get('quotes').randint(self.limit, config.MAX_PRICE)
         self.price = quoteprice
+        if self.tracker is not None:
+            self.tracker.sync(self)
         return quoteprice
 
     # Add price to price_hist
     def update_price_hist(self):
-        if self.price is not None:
-            if self.price_hist:
-                prev_price = self.price_hist[-1]
-                if self.price != prev_price:
-                    self.price_hist.append(self.price)
-            else:
-                self.price_hist.append(self.price)
+        self.population.record_price(self.idx)
 
     # At end of each day, reset price_hist
     def reset_price_hist(self):
-        self.price_hist = []
+        self.population.price_hist_len[self.idx] = 0
+        if self.tracker is not None:
+            self.tracker.touch(self)
 
     # Is a trader willing to trade at a given price?
     def willing_to_trade(self, oprice):
@@ -79,10 +85,7 @@ class AgentZIC:
 
     # Adjust bank balances of agent in deal
     # Adjust bank balances of agent in deal
-    def bookkeep(self, trade, verbose):
-        outstr = '%s (%s) bookkeeping: order = %s' % (self.tid, self.ttype, self.order)
-
-        transactionprice = trade['price']
+    def bookkeep(self, transactionprice, verbose, qty=1):
         if self.job == 'Buy':
             profit = self.limit - transactionprice
         else:
@@ -90,10 +93,15 @@ class AgentZIC:
 
         if profit < 0.0:
             profit = 0.0
-        self.balance += profit
+        self.balance += profit * qty
         if verbose:
-            print('%s profit=%d balance=%d' % (outstr, profit, self.balance))
-        self.del_order()
+            print('%s (%s) bookkeeping: order = %s profit=%d balance=%d'
+                  % (self.tid, self.ttype, self.order, profit, self.balance))
+        # A partly filled order stays with the trader for the rest of its quantity
+        if qty < self.order.qty:
+            self.order.qty -= qty
+        else:
+            self.del_order()
 
     # Update buyer/seller strategy after a order
     def update(self, oprice, otype, status, verbose):
@@ -1,27 +1,38 @@
-import random
 import sys
 import numpy as np
 
+import streams
 from order import Order
+from population import PopulationView, array_property
 
 
-class AgentZIP:
-    def __init__(self, ttype, tid, nodeid, job, margin):
+class AgentZIP(PopulationView):
+    # State held in TraderPopulation arrays
+    margin = array_property('margin')
+    beta = array_property('beta')
+    momentum = array_property('momentum')
+    prev_change = array_property('prev_change')
+    c_abs = array_property('c_abs')
+    c_rel = array_property('c_rel')
+
+    def __init__(self, ttype, tid, nodeid, job, margin, population=None):
         # All traders
         self.ttype = ttype
         self.tid = tid
         self.nodeid = nodeid
-        self.job = job
+        self.bind(population, job, nodeid)
+        self.population.is_zip[self.idx] = True
         self.active = False
         self.order = None  # TODO in Cliff '97 this is self.price and self.quant - maybe I need to change this?
         self.limit = None
         self.price = None
         self.balance = 0.0  # called bank in Cliff '97
-        self.price_hist = []
+        self.tracker = None  # EqTracker notified of quote changes
+        self.shout = Order(tid, None, None, 1, 'Shout', 0.0)  # reused by get_order for every shout
         # Specific to ZIP
         self.margin = margin  # called profit in Cliff '97
-        self.beta = 0.1 * random.randrange(1, 6)
-        self.momentum = 0.1 * random.random()
+        self.beta = 0.1 * streams.get('agents').randrange(1, 6)
+        self.momentum = 0.1 * streams.get('agents').random()
         self.prev_change = 0  # called last_d in Cliff '97
         # CONSTANTS
         self.c_abs = 0.05
@@ -43,34 +54,38 @@ class AgentZIP:
             order = None
         else:
             self.active = True
-            status = 'Shout'
-            quoteprice = self.price
-            order = Order(self.tid, self.order.otype, quoteprice, self.order.qty, status, time)
+            # The shout is only valid until the next call, it is the same Order every time
+            order = self.shout
+            order.otype = self.order.otype
+            order.price = self.price
+            order.qty = self.order.qty
+            order.status = 'Shout'
+            order.time = time
 
         return order
 
     def del_order(self):
         self.order = None
         self.active = False
+        if self.tracker is not None:
+            self.tracker.sync(self)
 
     def set_price(self):
         quoteprice = int(round(self.limit * (1.0 + self.margin), 0))
         self.price = quoteprice
+        if self.tracker is not None:
+            self.tracker.sync(self)
         return quoteprice
 
     # Add price to price_hist
     def update_price_hist(self):
-        if self.price is not None:
-            if self.price_hist:
-                prev_price = self.price_hist[-1]
-                if self.price != prev_price:
-                    self.price_hist.append(self.price)
-            else:
-                self.price_hist.append(self.price)
+        self.population.record_price(self.idx)
 
     # At end of each day, reset price_hist
     def reset_price_hist(self):
-        self.price_hist = []
+        self.population.price_hist_len[self.idx] = 0
+        if self.tracker is not None:
+            self.tracker.touch(self)
 
     # Is a trader willing to trade at a given price?
     def willing_to_trade(self, oprice):
@@ -82,10 +97,7 @@ class AgentZIP:
         return willing
 
     # Adjust bank balances of agent in deal
-    def bookkeep(self, trade, verbose):
-        outstr = '%s (%s) bookkeeping: order = %s' % (self.tid, self.ttype, self.order)
-
-        transactionprice = trade['price']
+    def bookkeep(self, transactionprice, verbose, qty=1):
         if self.job == 'Buy':
             profit = self.limit - transactionprice
         else:
@@ -93,13 +105,20 @@ class AgentZIP:
 
         if profit < 0.0:
             profit = 0.0
-        self.balance += profit
+        self.balance += profit * qty
         if verbose:
-            print('%s profit=%d balance=%d' % (outstr, profit, self.balance))
-        self.del_order()
+            print('%s (%s) bookkeeping: order = %s profit=%d balance=%d'
+                  % (self.tid, self.ttype, self.order, profit, self.balance))
+        # A partly filled order stays with the trader for the rest of its quantity
+        if qty < self.order.qty:
+            self.order.qty -= qty
+        else:
+            self.del_order()
 
     # Update buyer/seller strategy after a order
     def update(self, oprice, otype, status, verbose):
+        quotes = streams.get('quotes')
+
         # Update profit margin based on sale price using Widrow-Hoff style update rule with learning rate beta
         def profit_alter(target, profit_verbose):
             diff = target - self.price
@@ -128,15 +147,15 @@ class AgentZIP:
 
         def target_up(price):
             # print('%s RAISE' % self.tid)
-            ptrb_abs = self.c_abs * random.random()
-            ptrb_rel = price * (1.0 + (self.c_rel * random.random()))
+            ptrb_abs = self.c_abs * quotes.random()
+            ptrb_rel = price * (1.0 + (self.c_rel * quotes.random()))
             target = int(round(ptrb_rel + ptrb_abs, 0))
             return target
 
         def target_down(price):
             # print('%s LOWER' % self.tid)
-            ptrb_abs = self.c_abs * random.random()
-            ptrb_rel = price * (1.0 - (self.c_rel * random.random()))
+            ptrb_abs = self.c_abs * quotes.random()
+            ptrb_rel = price * (1.0 - (self.c_rel * quotes.random()))
             target = int(round(ptrb_rel - ptrb_abs, 0))
             return target
 
@@ -178,3 +197,104 @@ class AgentZIP:
                         profit_alter(target_price, verbose)
                 else:
                     sys.exit('FATAL: status is neither Deal or NoDeal in Agent.update()\n')
+
+
+# Apply AgentZIP.update to every ZIP trader in a TraderPopulation at once, or only to those in rows (unique row
+# indices) if given.
+# With rng=None perturbations are drawn from the 'quotes' stream in the same order as calling update() on
+# B00, S00, B01, S01, ..., so results are identical to the scalar path for a given seed.
+# Otherwise rng is a numpy Generator and all perturbations are drawn in one go.
+# Returns rows of traders whose quote price changed.
+def batch_update(population, oprice, otype, status, rng=None, rows=None):
+    # Updating everyone works on the population's arrays and scratch masks in place
+    if rows is None:
+        price = population.price
+        active = population.active
+        sell = population.is_sell
+        buy = population.is_buy
+        is_zip = population.is_zip
+        up, down, tmp = population.masks
+    else:
+        price = population.price[rows]
+        active = population.active[rows]
+        sell = population.is_sell[rows]
+        buy = population.is_buy[rows]
+        is_zip = population.is_zip[rows]
+        up, down, tmp = np.empty((3, rows.size), dtype=bool)
+
+    # Traders without a price are never picked, comparisons with NaN are False
+    if status == 'Deal':
+        # Sellers: could sell for more? raise. Wouldn't have got deal? lower
+        # Buyers: could buy for less? lower. Wouldn't have got deal? raise
+        np.less_equal(price, oprice, out=up)
+        up &= sell
+        np.greater_equal(price, oprice, out=down)
+        down &= buy
+        if otype == 'Ask':
+            np.less(price, oprice, out=tmp)
+            tmp &= active
+            tmp &= buy
+            up |= tmp
+        elif otype == 'Bid':
+            np.greater(price, oprice, out=tmp)
+            tmp &= active
+            tmp &= sell
+            down |= tmp
+    elif status == 'NoDeal':
+        # Sellers would've asked for more and lost deal, buyers would've bid less and lost deal
+        up.fill(False)
+        down.fill(False)
+        if otype == 'Bid':
+            np.less_equal(price, oprice, out=up)
+            up &= active
+            up &= buy
+        elif otype == 'Ask':
+            np.greater_equal(price, oprice, out=down)
+            down &= active
+            down &= sell
+    else:
+        sys.exit('FATAL: status is neither Deal or NoDeal in batch_update()\n')
+
+    up &= is_zip
+    down &= is_zip
+    np.logical_or(up, down, out=tmp)
+    fire = np.flatnonzero(tmp)
+    if fire.size == 0:
+        return fire
+
+    if rng is None:
+        n = population.n_traders
+        fired = fire if rows is None else rows[fire]
+        fire = fire[np.argsort(np.where(fired < n, 2 * fired, 2 * (fired - n) + 1))]
+        draws = streams.random_array(streams.get('quotes'), 2 * fire.size).reshape(-1, 2)
+        r_abs = draws[:, 0]
+        r_rel = draws[:, 1]
+    else:
+        r_abs = rng.random(fire.size)
+        r_rel = rng.random(fire.size)
+    idx = fire if rows is None else rows[fire]
+
+    # Perturbed target prices (target_up/target_down)
+    ptrb_abs = population.c_abs[idx] * r_abs
+    c_rel = population.c_rel[idx] * r_rel
+    target = np.where(up[fire],
+                      np.round((oprice * (1.0 + c_rel)) + ptrb_abs),
+                      np.round((oprice * (1.0 - c_rel)) - ptrb_abs))
+
+    # Widrow-Hoff update with momentum (profit_alter)
+    old_price = price[fire]
+    limit = population.limit[idx]
+    momentum = population.momentum[idx]
+    change = ((1.0 - momentum) * (population.beta[idx] * (target - old_price))) + \
+             (momentum * population.prev_change[idx])
+    population.prev_change[idx] = change
+    new_margin = ((old_price + change) / limit) - 1.0
+    keep = np.where(sell[fire], new_margin > 0.0, new_margin < 0.0)
+    margin = np.where(keep, new_margin, population.margin[idx])
+    population.margin[idx] = margin
+
+    # set_price
+    new_price = np.round(limit * (1.0 + margin))
+    population.price[idx] = new_price
+
+    return idx[new_price != old_price]
@@ -0,0 +1,412 @@
+import sys
+import numpy as np
+
+import config
+import data
+import warmstart
+
+# Lockstep simulation of many independent trials of the same market (same traders_spec, network and order
+# schedule) as one NumPy computation.
+# Trader state is held in (trials x traders) arrays, buyers in columns 0..n-1 and sellers in n..2n-1 as in
+# TraderPopulation, and each tick is processed for every trial at once: customer orders, equilibrium, trader
+# selection, matching with a willing neighbour, ZIP update and day data. The market rules are those of
+# session.run, but random numbers come from one numpy Generator, so results are not draw-for-draw the same as
+# the scalar path for a given seed.
+
+
+# Adjacency matrix of a topology.Network with nodes 0..n-1
+def get_adjacency(network, n_traders):
+    adj = np.zeros((n_traders, n_traders), dtype=bool)
+    adj[np.repeat(np.arange(n_traders), network.degrees()), network.indices] = True
+    return adj
+
+
+# Nodes whose traders are updated after a shout at each node (None if every trader is)
+def get_update_scope(update_scope, adj, n_traders):
+    if update_scope[0] == 'global':
+        return None
+    if update_scope[0] == 'neighbors':
+        hops = 1
+    elif update_scope[0] == 'k-hop':
+        hops = update_scope[1]
+    else:
+        sys.exit('FATAL: unknown update scope %s in get_update_scope()' % update_scope[0])
+    step = adj | np.eye(n_traders, dtype=bool)
+    reach = np.eye(n_traders, dtype=bool)
+    for _ in range(hops):
+        reach = (reach.astype(np.int64) @ step.astype(np.int64)) > 0
+    return reach
+
+
+# Customer order issue times for m trials of num_traders orders, as session.customer_orders get_issue_times()
+def get_issue_times(rng, m, num_traders, timemode, interval, fit_to_interval, shuffle):
+    interval = float(interval)
+    if num_traders < 1:
+        sys.exit('FATAL: n_traders < 1 in get_issue_times()')
+    elif num_traders == 1:
+        timestep = interval
+    else:
+        timestep = interval / (num_traders - 1)
+
+    n = np.arange(num_traders)
+    if timemode == 'periodic':
+        times = np.full((m, num_traders), interval)
+    elif timemode == 'drip-fixed':
+        times = np.tile(n * timestep, (m, 1))
+    elif timemode == 'drip-jitter':
+        times = n * timestep + timestep * rng.random((m, num_traders))
+    elif timemode == 'drip-poisson':
+        times = np.cumsum(rng.exponential(interval / num_traders, (m, num_traders)), axis=1)
+    else:
+        sys.exit('FATAL: unknown timemode in get_issue_times()')
+
+    if fit_to_interval:
+        # Squash/stretch so last arrival falls at t=interval
+        arrival_time = times[:, -1:]
+        times = np.where(arrival_time != interval, interval * (times / arrival_time), times)
+
+    if shuffle:
+        times = rng.permuted(times, axis=1)
+    return times
+
+
+# Schedule range and mode at current_time, as session.customer_orders get_sched_mode()
+def get_sched_mode(current_time, o_sched):
+    for sched in o_sched:
+        if (sched['from'] <= current_time) and (current_time < sched['to']):
+            return sched['ranges'], sched['stepmode']
+    sys.exit('FATAL: time = %5.2f not within any time in order_sched = %s' % (current_time, o_sched))
+
+
+# Customer order prices for m trials, as session.customer_orders get_order_price()
+def get_order_prices(rng, m, s_range, num_traders, s_mode):
+    min_price = max(min(s_range[0], s_range[1]), config.MIN_PRICE)
+    max_price = min(max(s_range[0], s_range[1]), config.MAX_PRICE)
+    step = (max_price - min_price) / (num_traders - 1)
+    half_step = round(step / 2.0)
+
+    base = min_price + (np.arange(num_traders) * step).astype(np.int64)
+    if s_mode == 'fixed':
+        prices = np.tile(base, (m, 1))
+    elif s_mode == 'jittered':
+        prices = base + rng.integers(-half_step, half_step + 1, (m, num_traders))
+    elif s_mode == 'random':
+        prices = rng.integers(min_price, max_price + 1, (m, num_traders))
+    else:
+        sys.exit('FATAL: Unknown mode in schedule in get_order_prices()')
+    return np.clip(prices, config.MIN_PRICE, config.MAX_PRICE).astype(np.float64)
+
+
+# Equilibrium price and quantity in each trial from buyers' and sellers' values of active traders,
+# as data.find_eq find_intersect()
+def find_intersect(b_values, b_active, s_values, s_active):
+    n_trials, n = b_values.shape
+    bp = -np.sort(np.where(b_active, -b_values, np.inf), axis=1)  # descending, inactive at the end as -inf
+    sp = np.sort(np.where(s_active, s_values, np.inf), axis=1)  # ascending, inactive at the end as inf
+    bnum = b_active.sum(axis=1)
+    snum = s_active.sum(axis=1)
+    max_q = np.minimum(bnum, snum)
+
+    # first q where bid/ask cross, padding means q >= max_q always crosses
+    cross = sp > bp
+    q_cross = np.where(cross.any(axis=1), cross.argmax(axis=1), n)
+    rows = np.arange(n_trials)
+
+    def at(arr, q):
+        return arr[rows, np.clip(q, 0, n - 1)]
+
+    # Rows where padding meets padding (inf + -inf) are computed but not used
+    last = max_q - 1
+    with np.errstate(invalid='ignore'):
+        terminal = np.where(bnum == snum, (at(sp, last) + at(bp, last)) * 0.5,
+                            np.where(max_q == bnum, (at(sp, last) + at(sp, last + 1)) * 0.5,
+                                     (at(bp, last) + at(bp, last + 1)) * 0.5))
+        straight = (at(sp, q_cross - 1) + at(bp, q_cross - 1)) * 0.5
+
+    found = q_cross < max_q
+    price = np.where(found, straight, terminal)
+    quant = np.where(found, q_cross, max_q).astype(np.float64)
+
+    none = (max_q == 0) | (q_cross == 0)
+    price[none] = np.nan
+    quant[none] = np.nan
+    return price, quant
+
+
+# Per-trial day statistics, vectorised version of data.StreamStats
+class BatchStats:
+    def __init__(self, n_trials):
+        self.count = np.zeros(n_trials)
+        self.sum = np.zeros(n_trials)
+        self.mean = np.zeros(n_trials)
+        self.m2 = np.zeros(n_trials)
+        self.min = np.full(n_trials, np.inf)
+        self.max = np.full(n_trials, -np.inf)
+
+    def reset(self, mask):
+        self.count[mask] = 0.0
+        self.sum[mask] = 0.0
+        self.mean[mask] = 0.0
+        self.m2[mask] = 0.0
+        self.min[mask] = np.inf
+        self.max[mask] = -np.inf
+
+    def add(self, values, mask):
+        mask = mask & ~np.isnan(values)
+        x = values[mask]
+        self.count[mask] += 1.0
+        self.sum[mask] += x
+        delta = x - self.mean[mask]
+        self.mean[mask] += delta / self.count[mask]
+        self.m2[mask] += delta * (x - self.mean[mask])
+        self.min[mask] = np.minimum(self.min[mask], x)
+        self.max[mask] = np.maximum(self.max[mask], x)
+
+    def get_mean(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.sum / self.count, np.nan)
+
+    def get_std(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, np.sqrt(self.m2 / self.count), np.nan)
+
+    def get_min(self):
+        return np.where(self.count > 0, self.min, np.nan)
+
+    def get_max(self):
+        return np.where(self.count > 0, self.max, np.nan)
+
+
+# Run trials in lockstep, returns a list of (ddat df, tdat df, trial ndat, number of days completed, None) per trial,
+# the same as exp.run_trial without instrumentation
+# With a warm start snapshot (see warmstart) ZIP traders start from its state, margins perturbed by
+# params['warm_start'][1]
+def run(trials, params, n_traders, buy_network, sell_network, rng, snapshot=None):
+    n = n_traders
+    n_all = 2 * n
+    n_trials = len(trials)
+    n_days = params['n_days']
+    order_sched = params['order_sched']
+    interval = order_sched['interval']
+    rows = np.arange(n_trials)
+    if params['clearing'] != 'bilateral':
+        sys.exit('FATAL: clearing mode %s not supported by batch.run()\n' % params['clearing'])
+    if order_sched.get('qty', 1) != 1:
+        sys.exit('FATAL: order quantity %s not supported by batch.run()\n' % order_sched['qty'])
+
+    # Traders
+    is_zip_node = []
+    for ttype, num in params['traders_spec']:
+        if ttype not in ('ZIP', 'ZIC'):
+            sys.exit('FATAL: agent type %s not supported by batch.run()\n' % ttype)
+        is_zip_node += [ttype == 'ZIP'] * num
+    is_zip = np.tile(np.array(is_zip_node), 2)
+    sell = np.arange(n_all) >= n
+
+    margin = np.where(sell, 0.01, -0.01) * rng.integers(5, 36, (n_trials, n_all))
+    margin[:, ~is_zip] = 0.0
+    beta = 0.1 * rng.integers(1, 6, (n_trials, n_all))
+    momentum = 0.1 * rng.random((n_trials, n_all))
+    prev_change = np.zeros((n_trials, n_all))
+    if snapshot is not None:
+        perturb = params['warm_start'][1]
+        warmstart.check(snapshot, is_zip, perturb)
+        for arr, name in ((margin, 'margin'), (beta, 'beta'), (momentum, 'momentum'), (prev_change, 'prev_change')):
+            arr[:, is_zip] = snapshot[name][is_zip]
+        margin[:, is_zip] *= 1.0 + perturb * (2.0 * rng.random((n_trials, np.count_nonzero(is_zip))) - 1.0)
+    c_abs = 0.05
+    c_rel = 0.05
+    limit = np.full((n_trials, n_all), np.nan)
+    price = np.full((n_trials, n_all), np.nan)
+    active = np.zeros((n_trials, n_all), dtype=bool)
+    balance = np.zeros((n_trials, n_all))
+
+    # Pending customer orders
+    issue_time = np.zeros((n_trials, n_all))
+    order_price = np.zeros((n_trials, n_all))
+    pending = np.zeros((n_trials, n_all), dtype=bool)
+
+    # Network: sellers seen by buyer at node v are adj_sell[v], buyers seen by seller at v are adj_buy[v]
+    adj_sell = get_adjacency(sell_network, n)
+    adj_buy = get_adjacency(buy_network, n)
+    scope = get_update_scope(params['update_scope'], adj_buy | adj_sell, n)
+
+    # Price history (dedup-on-change) kept as count, sum, sum of squares and last price
+    hist_n = np.zeros((n_trials, n_all))
+    hist_s1 = np.zeros((n_trials, n_all))
+    hist_s2 = np.zeros((n_trials, n_all))
+    hist_last = np.full((n_trials, n_all), np.nan)
+
+    # Day data
+    current_day = np.zeros(n_trials, dtype=np.int64)
+    teq_stats = BatchStats(n_trials)
+    aeq_stats = BatchStats(n_trials)
+    trans_stats = BatchStats(n_trials)
+    ndat_alpha = np.zeros((n_trials, n_all, n_days))
+    ndat_best = np.ones((n_trials, n_all, n_days))
+    tdat = [data.init_tdat() for _ in trials]
+    ddat = [data.ColumnRecorder(data.DDAT_COLUMNS, 64) for _ in trials]
+
+    def set_price(mask):
+        zip_mask = mask & is_zip
+        price[zip_mask] = np.round(limit[zip_mask] * (1.0 + margin[zip_mask]))
+        zic_buy = mask & ~is_zip & ~sell
+        price[zic_buy] = rng.integers(config.MIN_PRICE, limit[zic_buy].astype(np.int64) + 1)
+        zic_sell = mask & ~is_zip & sell
+        price[zic_sell] = rng.integers(limit[zic_sell].astype(np.int64), config.MAX_PRICE + 1)
+
+    def customer_orders(time):
+        # Trials with no pending orders get a new set, others issue any orders whose issue time is in the past
+        new = ~pending.any(axis=1)
+        m = new.sum()
+        if m:
+            for cols, side in ((slice(0, n), 'dem'), (slice(n, n_all), 'sup')):
+                times = get_issue_times(rng, m, n, order_sched['timemode'], interval, True, True)
+                s_range, s_mode = get_sched_mode(time, order_sched[side])
+                issue_time[new, cols] = time + times
+                order_price[new, cols] = get_order_prices(rng, m, s_range, n, s_mode)
+            pending[new] = True
+
+        due = pending & (issue_time < time) & ~new[:, None]
+        if due.any():
+            active[due] = True
+            limit[due] = order_price[due]
+            set_price(due)
+            pending[due] = False
+
+    def find_eq():
+        # Add price to price_hist for each trader
+        record = ~np.isnan(price) & ((hist_n == 0) | (price != hist_last))
+        p = np.where(record, price, 0.0)
+        hist_n[record] += 1.0
+        hist_s1[:] += p
+        hist_s2[:] += p * p
+        hist_last[record] = price[record]
+
+        aeq_p, aeq_q = find_intersect(price[:, :n], active[:, :n], price[:, n:], active[:, n:])
+        teq_p, teq_q = find_intersect(limit[:, :n], active[:, :n], limit[:, n:], active[:, n:])
+        return teq_p, teq_q, aeq_p, aeq_q
+
+    def update_traders(shouting, oprice, is_bid, deal, node):
+        o = oprice[:, None]
+        bid = is_bid[:, None]
+        valid = is_zip & ~np.isnan(price) & shouting[:, None]
+        if scope is not None:
+            valid &= np.tile(scope[node], 2)
+        with np.errstate(invalid='ignore'):
+            up = np.where(deal[:, None],
+                          np.where(sell, price <= o, (price < o) & active & ~bid),
+                          ~sell & active & bid & (price <= o)) & valid
+            down = np.where(deal[:, None],
+                            np.where(sell, (price > o) & active & bid, price >= o),
+                            sell & active & ~bid & (price >= o)) & valid
+        fire = up | down
+        n_fire = fire.sum()
+        if n_fire == 0:
+            return
+
+        o = np.broadcast_to(o, fire.shape)[fire]
+        ptrb_abs = c_abs * rng.random(n_fire)
+        rel = c_rel * rng.random(n_fire)
+        target = np.where(up[fire], np.round((o * (1.0 + rel)) + ptrb_abs), np.round((o * (1.0 - rel)) - ptrb_abs))
+
+        old_price = price[fire]
+        lim = limit[fire]
+        mom = momentum[fire]
+        change = ((1.0 - mom) * (beta[fire] * (target - old_price))) + (mom * prev_change[fire])
+        prev_change[fire] = change
+        new_margin = ((old_price + change) / lim) - 1.0
+        keep = np.where(np.broadcast_to(sell, fire.shape)[fire], new_margin > 0.0, new_margin < 0.0)
+        margin[fire] = np.where(keep, new_margin, margin[fire])
+        price[fire] = np.round(lim * (1.0 + margin[fire]))
+
+    def end_day(mask):
+        teq = teq_stats.get_mean()
+        aeq = aeq_stats.get_mean()
+        t = teq[:, None]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Smith's alpha from price history, sum((x - eq)^2) = s2 - 2 eq s1 + n eq^2
+            sum_sqrd = np.maximum(hist_s2 - 2.0 * t * hist_s1 + hist_n * t * t, 0.0)
+            alpha = np.where(hist_n > 0, (1.0 / t) * np.sqrt(sum_sqrd / hist_n), np.nan)
+            # Best possible alpha
+            worse = np.where(sell, limit > t, limit < t)
+            best = np.where(np.isnan(limit), np.nan, np.where(worse, (1.0 / t) * np.abs(limit - t), 0.0))
+
+        days = np.minimum(current_day, n_days - 1)
+        record = mask & (current_day < n_days)
+        ndat_alpha[record, :, days[record]] = alpha[record]
+        ndat_best[record, :, days[record]] = best[record]
+
+        trans_mean = trans_stats.get_mean()
+        trans_std = trans_stats.get_std()
+        trans_min = trans_stats.get_min()
+        trans_max = trans_stats.get_max()
+        for b in np.flatnonzero(mask):
+            ddat[b].append(trials[b], current_day[b], teq[b], aeq[b], trans_mean[b], trans_mean[b],
+                           trans_stats.count[b], trans_min[b], trans_max[b], trans_std[b])
+
+        hist_n[mask] = 0.0
+        hist_s1[mask] = 0.0
+        hist_s2[mask] = 0.0
+        current_day[mask] += 1
+        teq_stats.reset(mask)
+        aeq_stats.reset(mask)
+        trans_stats.reset(mask)
+
+    def update_ddat(mask, time, teq_p, aeq_p, trade_price):
+        end = mask & (time > interval * (current_day + 1))
+        if end.any():
+            end_day(end)
+        teq_stats.add(teq_p, mask)
+        aeq_stats.add(aeq_p, mask)
+        trans_stats.add(trade_price, mask)
+
+    timestep = 1.0 / float(n_traders * 2)
+    time = params['start']
+    while time <= params['end']:
+        customer_orders(time)
+        teq_p, teq_q, aeq_p, aeq_q = find_eq()
+
+        # Get shout (order) from randomly chosen trader, traders without an order don't shout
+        tid = rng.integers(0, n_all, n_trials)
+        shouting = active[rows, tid]
+        oprice = price[rows, tid]
+        is_bid = tid < n
+        node = tid % n
+
+        # Neighbours willing to trade, one chosen uniformly at random
+        with np.errstate(invalid='ignore'):
+            willing = np.where(is_bid[:, None],
+                               adj_sell[node] & active[:, n:] & (price[:, n:] <= oprice[:, None]),
+                               adj_buy[node] & active[:, :n] & (price[:, :n] >= oprice[:, None]))
+        willing &= shouting[:, None]
+        n_willing = willing.sum(axis=1)
+        deal = n_willing > 0
+        j = (rng.random(n_trials) * n_willing).astype(np.int64)
+        chosen = (np.cumsum(willing, axis=1) > j[:, None]).argmax(axis=1)
+        counterparty = np.where(is_bid, n + chosen, chosen)
+
+        # Bookkeeping of both parties to each deal
+        trade_price = np.where(deal, oprice, np.nan)
+        for parties in (tid, counterparty):
+            d_rows = rows[deal]
+            d_cols = parties[deal]
+            profit = np.where(sell[d_cols], oprice[deal] - limit[d_rows, d_cols], limit[d_rows, d_cols] - oprice[deal])
+            balance[d_rows, d_cols] += np.maximum(profit, 0.0)
+            active[d_rows, d_cols] = False
+        for b in np.flatnonzero(deal):
+            data.update_tdat(tdat[b], trials[b], time, [teq_p[b], teq_q[b], aeq_p[b], aeq_q[b]], oprice[b])
+
+        update_traders(shouting, oprice, is_bid, deal, node)
+        update_ddat(shouting, time, teq_p, aeq_p, trade_price)
+        time += timestep
+
+    update_ddat(np.ones(n_trials, dtype=bool), time, teq_p, aeq_p, trade_price)
+
+    results = []
+    for b, trial in enumerate(trials):
+        trial_ndat = data.NetworkData(n, n_days)
+        trial_ndat.alpha = ndat_alpha[b]
+        trial_ndat.best = ndat_best[b]
+        results.append((ddat[b].to_df(), tdat[b].to_df(), trial_ndat, min(current_day[b], n_days), None))
+    return results
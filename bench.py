@@ -0,0 +1,337 @@
+import sys
+import json
+import time
+import random
+import timeit
+import tracemalloc
+import argparse
+import platform
+import itertools
+
+import numpy as np
+
+import data
+import exp
+import setup
+import session
+import streams
+import version
+from counterparty import CounterpartyIndex
+from eqtracker import EqTracker
+from order import Order
+from population import TraderPopulation
+
+# Benchmarks of the simulation hot paths with fixed seeds, over number of traders per side, network type and agent
+# mix. Micro-benchmarks time single calls on a market where every trader holds an order ('tick' being one tick of
+# session.run without customer orders or bookkeeping) and measure memory allocated per call, end-to-end benchmarks
+# time whole trials. Results are saved as json baselines and compared with
+#   python bench.py run --out new.json
+#   python bench.py compare base.json new.json --threshold 0.1 [--metric bytes_per_call]
+# The fast paths are checked against the code they replaced, on whole trials, with
+#   python bench.py check
+MICRO = ('find_eq', 'eq_tracker', 'process_order', 'process_order_scan', 'update_traders', 'update_ddat', 'tick')
+NETWORKS = ('FC', 'Random', 'SW', 'SF')
+MIXES = ('ZIP', 'ZIC', 'ZIP+ZIC')
+SCOPES = (('global', 0), ('neighbors', 0), ('k-hop', 2))
+INTERVAL = 30
+
+
+# Network spec for setup.build_network, sparse networks keep mean degree roughly constant as n grows
+def get_network(network_type, n_traders):
+    if network_type == 'FC':
+        return ['FC', 0, 0]
+    elif network_type == 'Random':
+        return ['Random', min(1.0, 8.0 / n_traders), 0]
+    elif network_type == 'SW':
+        return ['SW', 0.1, min(4, n_traders - 1)]
+    elif network_type == 'SF':
+        return ['SF', 0, min(2, n_traders - 1)]
+    sys.exit('FATAL: unknown network type %s in get_network()' % network_type)
+
+
+def get_traders_spec(mix, n_traders):
+    if mix == 'ZIP+ZIC':
+        return [('ZIP', n_traders // 2), ('ZIC', n_traders - n_traders // 2)]
+    return [(mix, n_traders)]
+
+
+def get_params(traders_spec, network, n_days):
+    sched = [{'from': 0, 'to': n_days * INTERVAL, 'ranges': (50, 150), 'stepmode': 'fixed'}]
+    return {'n_trials': 1,
+            'network': network,
+            'n_days': n_days,
+            'start': 0.0,
+            'end': float(n_days * INTERVAL),
+            'traders_spec': traders_spec,
+            'order_sched': {'interval': INTERVAL, 'timemode': 'drip-poisson', 'dem': sched, 'sup': sched},
+            'zip_update': 'batch',
+            'update_scope': ['global', 0],
+            'crn': False,
+            'rng': 'python',
+            'instrument': False,
+            'warm_start': [0, 0.0],
+            'clearing': 'bilateral'}
+
+
+# Market in mid-session: every trader holds a customer order with limits spread over [50, 150]
+def make_market(n_traders, network_type, mix, seed):
+    random.seed(seed)
+    streams.reset()
+    traders_spec = get_traders_spec(mix, n_traders)
+    n_traders, buy_network, sell_network = setup.build_network(traders_spec, get_network(network_type, n_traders))
+    traders = TraderPopulation(n_traders)
+    setup.populate_market(traders_spec, traders, buy_network, sell_network, False)
+
+    asks = CounterpartyIndex(traders, sell_network, 'Sell')
+    bids = CounterpartyIndex(traders, buy_network, 'Buy')
+    tracker = EqTracker([asks, bids])
+    tracker.attach(traders)
+    limits = np.linspace(50, 150, n_traders).astype(int).tolist()
+    random.shuffle(limits)
+    for n in range(n_traders):
+        traders.buyer(n).add_order(Order(traders.buyer(n).tid, 'Bid', limits[n], 1, 'Pending', 0.0))
+        traders.seller(n).add_order(Order(traders.seller(n).tid, 'Ask', limits[-1 - n], 1, 'Pending', 0.0))
+    return traders, n_traders, buy_network, sell_network, asks, bids, tracker
+
+
+# Fastest of repeat timings of func, in seconds per call
+def time_func(func, repeat):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number, number
+
+
+# Mean peak memory allocated by a call of func above what was allocated before it, in bytes: the size of the
+# temporaries it creates
+def measure_allocs(func, calls=200):
+    func()
+    total = 0
+    tracemalloc.start()
+    for _ in range(calls):
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - start
+    tracemalloc.stop()
+    return total / calls
+
+
+def run_micro(n_traders, network_type, mix, seed, repeat):
+    traders, n_traders, buy_network, sell_network, asks, bids, tracker = make_market(n_traders, network_type, mix,
+                                                                                      seed)
+    shouts = itertools.cycle([trader.get_order(0.0) for trader in random.sample(traders.agents, len(traders.agents))])
+    ddat = data.init_ddat(INTERVAL)
+    ndat = data.init_ndat(get_traders_spec(mix, n_traders), 1)
+
+    def process_order():
+        session.process_order(next(shouts), 0.0, traders, buy_network, sell_network, False, asks, bids)
+
+    def process_order_scan():
+        session.process_order(next(shouts), 0.0, traders, buy_network, sell_network, False)
+
+    def update_traders():
+        order = next(shouts)
+        order.status = 'NoDeal' if order.status == 'Deal' else 'Deal'
+        session.update_traders(order, traders, n_traders, buy_network, sell_network, False)
+
+    def update_ddat():
+        ddat.update_ddat(1, 1.0, traders, n_traders, [100.0, 10, 98.0, 8], 101.0, ndat)
+
+    selection_rng = random.Random(seed)
+
+    def tick():
+        order = selection_rng.choice(traders.agents).get_order(0.0)
+        eq = tracker.find_eq()
+        counterparty = session.process_order(order, 0.0, traders, buy_network, sell_network, False, asks, bids)
+        session.update_traders(order, traders, n_traders, buy_network, sell_network, False)
+        ddat.update_ddat(1, 1.0, traders, n_traders, eq, np.nan if counterparty is None else order.price, ndat)
+
+    funcs = {'find_eq': lambda: data.find_eq(traders, n_traders),
+             'eq_tracker': tracker.find_eq,
+             'process_order': process_order,
+             'process_order_scan': process_order_scan,
+             'update_traders': update_traders,
+             'update_ddat': update_ddat,
+             'tick': tick}
+
+    results = []
+    for name in MICRO:
+        seconds, number = time_func(funcs[name], repeat)
+        results.append({'name': name, 'n_traders': n_traders, 'network': network_type, 'mix': mix,
+                        'seconds': seconds, 'number': number, 'bytes_per_call': measure_allocs(funcs[name])})
+    return results
+
+
+# Time of a whole trial of n_days through exp.run_trial, named trial-<clearing> unless clearing is bilateral
+def run_e2e(n_traders, network_type, mix, seed, repeat, n_days, clearing='bilateral'):
+    random.seed(seed)
+    traders_spec = get_traders_spec(mix, n_traders)
+    network = get_network(network_type, n_traders)
+    n_traders, buy_network, sell_network = setup.build_network(traders_spec, network)
+    params = get_params(traders_spec, network, n_days)
+    params['clearing'] = clearing
+    exp.init_market(params, n_traders, buy_network, sell_network)
+
+    seconds, _ = time_func(lambda: exp.run_trial(1, seed), repeat)
+    ticks = n_days * INTERVAL * 2 * n_traders
+    name = 'trial' if clearing == 'bilateral' else 'trial-' + clearing
+    return {'name': name, 'n_traders': n_traders, 'network': network_type, 'mix': mix, 'seconds': seconds,
+            'number': 1, 'ticks_per_sec': ticks / seconds}
+
+
+def get_key(result):
+    return '%s/%s/%s/%d' % (result['name'], result['network'], result['mix'], result['n_traders'])
+
+
+def run(args):
+    results = []
+    if args.only in (None, 'micro'):
+        for n_traders, network_type, mix in itertools.product(args.sizes, args.networks, args.mixes):
+            print('micro %s %s %d' % (network_type, mix, n_traders))
+            results += run_micro(n_traders, network_type, mix, args.seed, args.repeat)
+    if args.only in (None, 'e2e'):
+        for n_traders, network_type, mix, clearing in itertools.product(args.e2e_sizes, args.networks, args.mixes,
+                                                                        args.clearing):
+            print('trial %s %s %s %d' % (clearing, network_type, mix, n_traders))
+            results.append(run_e2e(n_traders, network_type, mix, args.seed, args.repeat, args.days, clearing))
+
+    baseline = {'meta': {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                         'python': platform.python_version(),
+                         'numpy': np.__version__,
+                         'machine': platform.platform(),
+                         'code': version.get_code_version(),
+                         'seed': args.seed},
+                'results': {get_key(r): r for r in results}}
+    with open(args.out, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    print('Wrote %d benchmarks to %s' % (len(results), args.out))
+
+
+# Compare new benchmark results with a baseline, regressions are benchmarks whose metric (time or bytes allocated
+# per call) grew by more than threshold
+def compare(args):
+    with open(args.baseline) as f:
+        base = json.load(f)['results']
+    with open(args.new) as f:
+        new = json.load(f)['results']
+
+    metric = args.metric
+    scale, unit = (1e6, 'us') if metric == 'seconds' else (1, 'bytes')
+    keys = set(k for k in base if metric in base[k])
+    new_keys = set(k for k in new if metric in new[k])
+
+    regressions = []
+    print('%-45s %12s %12s %8s' % ('benchmark', 'base (%s)' % unit, 'new (%s)' % unit, 'ratio'))
+    for key in sorted(keys & new_keys):
+        ratio = new[key][metric] / base[key][metric] if base[key][metric] else float('inf') if new[key][metric] else 1.0
+        flag = ''
+        if ratio > 1.0 + args.threshold:
+            flag = ' REGRESSION'
+            regressions.append(key)
+        elif ratio < 1.0 - args.threshold:
+            flag = ' better'
+        print('%-45s %12.2f %12.2f %8.3f%s' % (key, base[key][metric] * scale, new[key][metric] * scale, ratio,
+                                               flag))
+    for key in sorted(keys ^ new_keys):
+        print('%-45s only in %s' % (key, args.baseline if key in keys else args.new))
+
+    if regressions:
+        sys.exit('%d benchmark(s) more than %.0f%% worse than baseline' % (len(regressions), args.threshold * 100))
+    print('No regressions')
+
+
+# Equal, NaN counting as equal to NaN
+def same(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    return a.shape == b.shape and np.array_equal(a, b, equal_nan=True)
+
+
+# Trial on the market set by exp.init_market with EqTracker.find_eq checked against data.find_eq on every call.
+# data.find_eq also records every trader's price history, which adds nothing if the tracker recorded the prices it
+# should have.
+def run_checked_trial(seed, case):
+    find_eq = EqTracker.find_eq
+
+    def checked_find_eq(tracker):
+        eq = find_eq(tracker)
+        expected = data.find_eq(tracker.population, tracker.population.n_traders)
+        if not same(eq, expected):
+            sys.exit('FATAL: %s: EqTracker.find_eq %s, data.find_eq %s' % (case, eq, expected))
+        return eq
+
+    EqTracker.find_eq = checked_find_eq
+    try:
+        return exp.run_trial(1, seed)
+    finally:
+        EqTracker.find_eq = find_eq
+
+
+# Check the incremental equilibrium and batch ZIP updates against data.find_eq and the scalar AgentZIP.update.
+# For each market and update scope a trial is run with batch updates, and again with scalar updates and every
+# find_eq checked. The two trials must give identical day, trading and network data.
+def check(args):
+    n_cases = 0
+    for n_traders, network_type, mix, scope in itertools.product(args.sizes, args.networks, args.mixes, SCOPES):
+        case = '%s %s %d %s' % (network_type, mix, n_traders, scope[0])
+        print('check %s' % case)
+        random.seed(args.seed)
+        traders_spec = get_traders_spec(mix, n_traders)
+        network = get_network(network_type, n_traders)
+        n_traders, buy_network, sell_network = setup.build_network(traders_spec, network)
+        params = get_params(traders_spec, network, args.days)
+        params['update_scope'] = list(scope)
+
+        exp.init_market(params, n_traders, buy_network, sell_network)
+        ddat, tdat, ndat, _, _ = exp.run_trial(1, args.seed)
+        params['zip_update'] = 'scalar'
+        ref_ddat, ref_tdat, ref_ndat, _, _ = run_checked_trial(args.seed, case)
+
+        for name, new, ref in (('ddat', ddat, ref_ddat), ('tdat', tdat, ref_tdat),
+                               ('alpha', ndat.alpha, ref_ndat.alpha), ('best', ndat.best, ref_ndat.best)):
+            if not same(new, ref):
+                sys.exit('FATAL: %s: %s differs between batch and scalar ZIP updates' % (case, name))
+        n_cases += 1
+    print('%d markets checked, no differences' % n_cases)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the market simulation')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run benchmarks and save results')
+    run_parser.add_argument('--out', default='bench.json', help='json file to write results to')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                            help='traders per side for micro-benchmarks')
+    run_parser.add_argument('--e2e-sizes', type=int, nargs='+', default=[10, 100],
+                            help='traders per side for end-to-end trials')
+    run_parser.add_argument('--networks', nargs='+', default=list(NETWORKS), choices=NETWORKS)
+    run_parser.add_argument('--mixes', nargs='+', default=list(MIXES), choices=MIXES)
+    run_parser.add_argument('--days', type=int, default=1, help='days per end-to-end trial')
+    run_parser.add_argument('--clearing', nargs='+', default=['bilateral'], choices=('bilateral', 'cda', 'cda-network'),
+                            help='clearing modes of end-to-end trials')
+    run_parser.add_argument('--repeat', type=int, default=3, help='timings per benchmark, the fastest is kept')
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--only', choices=('micro', 'e2e'), default=None)
+
+    compare_parser = subparsers.add_parser('compare', help='compare results with a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown, 0.1 = 10%%')
+    compare_parser.add_argument('--metric', choices=('seconds', 'bytes_per_call'), default='seconds')
+
+    check_parser = subparsers.add_parser('check', help='check fast paths against the code they replaced')
+    check_parser.add_argument('--sizes', type=int, nargs='+', default=[10, 30], help='traders per side')
+    check_parser.add_argument('--networks', nargs='+', default=list(NETWORKS), choices=NETWORKS)
+    check_parser.add_argument('--mixes', nargs='+', default=list(MIXES), choices=MIXES)
+    check_parser.add_argument('--days', type=int, default=2, help='days per trial')
+    check_parser.add_argument('--seed', type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'check':
+        check(args)
+    else:
+        compare(args)
@@ -0,0 +1,107 @@
+import os
+import sys
+import glob
+import json
+import pickle
+import zlib
+
+# Checkpoints of an experiment in a directory:
+#   meta.json: params, master seed and batch size the checkpoints belong to, and whether the directory was created
+#              for them
+#   trial_NNNN.result: results of a finished trial (as returned by exp.run_trial)
+#   trial_NNNN.state: state of an unfinished trial at the end of its last completed day (from session.run)
+# Files are zlib-compressed pickles, written to a temporary file and renamed into place so that a checkpoint is
+# either the old one or the new one, never partly written.
+# Only these files are ever removed, other files in the directory are left alone, and the directory itself is only
+# removed if it was created for the checkpoints.
+FILES = ('meta.json', 'meta.json.tmp', 'trial_*.state', 'trial_*.result', 'trial_*.tmp')
+
+
+# Write obj to path atomically
+def write_atomic(path, obj):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(zlib.compress(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return pickle.loads(zlib.decompress(f.read()))
+
+
+class Checkpoints:
+    def __init__(self, path):
+        self.path = path
+
+    def get_path(self, trial, kind):
+        return os.path.join(self.path, 'trial_%04d.%s' % (trial, kind))
+
+    # Contents of meta.json, None if there is none
+    def read_meta(self):
+        meta_path = os.path.join(self.path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)
+
+    # Master seed recorded in the checkpoints, None if there are none
+    def get_seed(self):
+        meta = self.read_meta()
+        return meta['seed'] if meta is not None else None
+
+    def created_dir(self):
+        meta = self.read_meta()
+        return meta is not None and meta.get('created_dir', False)
+
+    # Start checkpointing an experiment. If resuming, existing checkpoints must be for the same experiment,
+    # otherwise any old checkpoints are removed.
+    def start(self, params, seed, batch_size, resume):
+        meta = json.loads(json.dumps({'params': params, 'seed': seed, 'batch_size': batch_size}, sort_keys=True))
+        meta_path = os.path.join(self.path, 'meta.json')
+        old_meta = self.read_meta()
+        if resume and old_meta is not None:
+            old_meta.pop('created_dir', None)
+            if old_meta != meta:
+                sys.exit('FATAL: checkpoints in %s are for a different experiment, seed or batch size'
+                         % self.path)
+            return
+        created_dir = self.created_dir() or not os.path.isdir(self.path)
+        self.clear()
+        os.makedirs(self.path, exist_ok=True)
+        meta['created_dir'] = created_dir
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f, indent=2, sort_keys=True)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def save_state(self, trial, state):
+        write_atomic(self.get_path(trial, 'state'), state)
+
+    # Saved state of an unfinished trial, None if there is none
+    def load_state(self, trial):
+        path = self.get_path(trial, 'state')
+        return read(path) if os.path.exists(path) else None
+
+    # Save results of a finished trial, its state is no longer needed
+    def save_result(self, trial, result):
+        write_atomic(self.get_path(trial, 'result'), result)
+        state_path = self.get_path(trial, 'state')
+        if os.path.exists(state_path):
+            os.remove(state_path)
+
+    def has_result(self, trial):
+        return os.path.exists(self.get_path(trial, 'result'))
+
+    def load_result(self, trial):
+        return read(self.get_path(trial, 'result'))
+
+    # Remove all checkpoint files, and the directory if it was created for them and nothing else is in it
+    def clear(self):
+        created_dir = self.created_dir()
+        for pattern in FILES:
+            for path in glob.glob(os.path.join(glob.escape(self.path), pattern)):
+                os.remove(path)
+        if created_dir and os.path.isdir(self.path) and not os.listdir(self.path):
+            os.rmdir(self.path)
@@ -0,0 +1,70 @@
+import numpy as np
+
+import streams
+
+
+# Index of one side of the market (buyers or sellers) by network node: for each node, the active quotes of its
+# neighbours on that side sorted by price, so counterparties willing to trade at a given price are counted with a
+# binary search. A node's quotes are rebuilt on demand once a neighbour's quote has changed.
+# The counterparty is then picked among the willing neighbours in network order with the same draw as
+# session.process_order's scan of every neighbour, so a given seed matches the same traders either way.
+class CounterpartyIndex:
+    def __init__(self, population, network, job):
+        self.population = population
+        self.job = job
+        self.network = network
+        self.offset = population.index(job, 0)  # row of the trader at node 0
+        self.set_network()
+        n_nodes = network.number_of_nodes()
+        self.dirty = np.ones(n_nodes, dtype=bool)
+        self.prices = [None] * n_nodes
+        self.quotes = [None] * n_nodes
+
+    def set_network(self):
+        self.indptr = self.network.indptr
+        self.indices = self.network.indices
+        self.rows = self.indices + self.offset
+
+    # Adjacency arrays are left to the network when pickled (a network loaded from a file pickles as its path)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('indptr', 'indices', 'rows'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.set_network()
+
+    # Called by EqTracker when a trader's quote changes, invalidates the nodes that see it
+    def quote_changed(self, trader):
+        if trader.job == self.job:
+            v = trader.nodeid
+            self.dirty[self.indices[self.indptr[v]:self.indptr[v + 1]]] = True
+
+    def rebuild(self, nodeid):
+        rows = self.rows[self.indptr[nodeid]:self.indptr[nodeid + 1]]
+        rows = rows[self.population.active[rows]]
+        self.quotes[nodeid] = rows  # active neighbours in network order
+        self.prices[nodeid] = np.sort(self.population.price[rows])
+        self.dirty[nodeid] = False
+
+    # Number of neighbours of nodeid willing to trade at oprice
+    def count_willing(self, nodeid, oprice):
+        if self.dirty[nodeid]:
+            self.rebuild(nodeid)
+        prices = self.prices[nodeid]
+        if self.job == 'Buy':
+            return len(prices) - np.searchsorted(prices, oprice, 'left')
+        return np.searchsorted(prices, oprice, 'right')
+
+    # Neighbour of nodeid willing to trade at oprice chosen uniformly at random, None if there is none
+    def choose(self, nodeid, oprice):
+        n_willing = self.count_willing(nodeid, oprice)
+        if n_willing == 0:
+            return None
+        j = streams.get('matching').randrange(n_willing)
+        rows = self.quotes[nodeid]
+        prices = self.population.price[rows]
+        willing = prices >= oprice if self.job == 'Buy' else prices <= oprice
+        return self.population.agents[rows[np.flatnonzero(willing)[j]]]
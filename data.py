@@ -1,12 +1,112 @@
+import io
 import os
-import sys
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 import numpy as np
 import math
 import matplotlib.pyplot as plt
-import networkx as nx
 
+####################- Recorder -####################
+
+
+# Append-only table of typed NumPy columns, capacity doubles when full.
+# Converted to a DataFrame (or Arrow table) only when the data is needed.
+class ColumnRecorder:
+    def __init__(self, columns, capacity=1024):
+        self.columns = columns  # list of (name, dtype)
+        self.arrays = [np.empty(capacity, dtype=dtype) for _, dtype in columns]
+        self.capacity = capacity
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    # Append one row, values in column order
+    def append(self, *values):
+        if self.size == self.capacity:
+            self.grow()
+        i = self.size
+        for arr, value in zip(self.arrays, values):
+            arr[i] = value
+        self.size = i + 1
+
+    def grow(self):
+        self.capacity *= 2
+        for n, arr in enumerate(self.arrays):
+            new_arr = np.empty(self.capacity, dtype=arr.dtype)
+            new_arr[:self.size] = arr[:self.size]
+            self.arrays[n] = new_arr
+
+    # Values of the last row appended, in column order
+    def last(self):
+        return tuple(arr[self.size - 1].item() for arr in self.arrays)
+
+    # View of recorded values of a column
+    def column(self, name):
+        for (col_name, _), arr in zip(self.columns, self.arrays):
+            if col_name == name:
+                return arr[:self.size]
+        raise KeyError(name)
+
+    def to_df(self):
+        return pd.DataFrame({name: arr[:self.size].copy() for (name, _), arr in zip(self.columns, self.arrays)},
+                            columns=[name for name, _ in self.columns])
+
+    # Requires pyarrow
+    def to_arrow(self):
+        import pyarrow as pa
+        return pa.table({name: arr[:self.size] for (name, _), arr in zip(self.columns, self.arrays)})
+
+####################- End of Recorder -####################
+####################- Result Sink -####################
+
+
+# Streams csv results into a zip archive as they are produced, e.g. one chunk of rows per trial, so that results
+# never have to be held in memory or serialised as one string.
+# Only one zip entry can be open for writing at a time: the stream named direct is written straight into the
+# archive, the others are spooled to temporary files and copied into the archive in chunks on close().
+class ResultSink:
+    def __init__(self, zip_file, direct=None):
+        self.zip_file = zip_file
+        self.direct = direct
+        self.handles = {}
+
+    # Append rows of df to csv stream name, header is written with the first chunk
+    def write(self, name, df):
+        handle = self.handles.get(name)
+        header = handle is None
+        if header:
+            if name == self.direct:
+                raw = self.open_entry(name)
+            else:
+                raw = tempfile.TemporaryFile()
+            handle = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+            self.handles[name] = handle
+        df.to_csv(handle, index=False, header=header)
+
+    def close(self):
+        if self.direct in self.handles:
+            self.handles.pop(self.direct).close()
+        for name, handle in self.handles.items():
+            handle.flush()
+            raw = handle.detach()
+            raw.seek(0)
+            with self.open_entry(name) as entry:
+                shutil.copyfileobj(raw, entry)
+            raw.close()
+        self.handles = {}
+
+    def open_entry(self, name):
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = self.zip_file.compression
+        return self.zip_file.open(info, 'w', force_zip64=True)
+
+####################- End of Result Sink -####################
 ####################- Trading Data -####################
 
 
@@ -60,20 +160,20 @@ def find_eq(traders, n_traders):
     s_price = []
     s_limit = []
     for t in range(n_traders):
-        bname = 'B%02d' % t
+        buyer = traders.buyer(t)
         # Add price to price_hist for each trader
-        traders[bname].update_price_hist()
-        if traders[bname].active:
-            b_price.append(traders[bname].price)
-            b_limit.append(traders[bname].limit)
+        buyer.update_price_hist()
+        if buyer.active:
+            b_price.append(buyer.price)
+            b_limit.append(buyer.limit)
             n_buyers += 1
 
-        sname = 'S%02d' % t
+        seller = traders.seller(t)
         # Add price to price_hist for each trader
-        traders[sname].update_price_hist()
-        if traders[sname].active:
-            s_price.append(traders[sname].price)
-            s_limit.append(traders[sname].limit)
+        seller.update_price_hist()
+        if seller.active:
+            s_price.append(seller.price)
+            s_limit.append(seller.limit)
             n_sellers += 1
 
     b_price.sort(reverse=True)
@@ -90,35 +190,84 @@ def find_eq(traders, n_traders):
     return eq
 
 
-# Initialise trading data df
+# Trading data columns, all float as in the csv output
+TDAT_COLUMNS = [('trialID', np.float64), ('time', np.float64), ('TEQ_P', np.float64), ('TEQ_Q', np.float64),
+                ('AEQ_P', np.float64), ('AEQ_Q', np.float64), ('Transaction', np.float64), ('Profit_Diff', np.float64)]
+
+
+# Initialise trading data recorder
 def init_tdat():
-    df = pd.DataFrame(columns=['trialID', 'time', 'TEQ_P', 'TEQ_Q', 'AEQ_P', 'AEQ_Q', 'Transaction', 'Profit_Diff'])
-    return df
+    return ColumnRecorder(TDAT_COLUMNS)
 
 
-# Update trading df with data (equilibrium prices + quantities, transaction price)
-def update_tdat(tdat_df, trial, time, eq, trade):
+# Update trading data with equilibrium prices + quantities, transaction price
+def update_tdat(tdat, trial, time, eq, trade):
     diff = abs(trade - eq[0])
-
-    tdat = {'trialID': trial,
-            'time': time,
-            'TEQ_P': eq[0],
-            'TEQ_Q': eq[1],
-            'AEQ_P': eq[2],
-            'AEQ_Q': eq[3],
-            'Transaction': trade,
-            'Profit_Diff': diff}
-    tdat_df = tdat_df.append(tdat, ignore_index=True)
-    return tdat_df
+    tdat.append(trial, time, eq[0], eq[1], eq[2], eq[3], trade, diff)
+    return tdat
 
 ####################- End of Trading Data -####################
 ####################- Day Data -####################
 
 
-# Initialise day data df with class instantiation
+# Day data columns, all float as in the csv output
+DDAT_COLUMNS = [('trialID', np.float64), ('day', np.float64), ('TEQ_P', np.float64), ('AEQ_P', np.float64),
+                ('Transaction', np.float64), ('VWAP', np.float64), ('N_Trades', np.float64),
+                ('Trans_Min', np.float64), ('Trans_Max', np.float64), ('Trans_Std', np.float64)]
+
+
+# Running count, sum, variance (Welford), min, max and weighted mean of a stream of values, O(1) per value.
+# NaN values are ignored.
+class StreamStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.sum = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.wsum = 0.0
+        self.weight = 0.0
+
+    def add(self, value, weight=1.0):
+        if math.isnan(value):
+            return
+        self.count += 1
+        self.sum += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.wsum += value * weight
+        self.weight += weight
+
+    def get_mean(self):
+        return self.sum / self.count if self.count else np.nan
+
+    # Population standard deviation
+    def get_std(self):
+        return math.sqrt(self.m2 / self.count) if self.count else np.nan
+
+    def get_min(self):
+        return self.min if self.count else np.nan
+
+    def get_max(self):
+        return self.max if self.count else np.nan
+
+    # Weighted mean, e.g. volume-weighted average price
+    def get_wmean(self):
+        return self.wsum / self.weight if self.weight else np.nan
+
+
+# Initialise day data recorder with class instantiation
 def init_ddat(interval):
-    df = pd.DataFrame(columns=['trialID', 'day', 'TEQ_P', 'AEQ_P', 'Transaction'])
-    ddat = DayData(df, interval)
+    ddat = DayData(ColumnRecorder(DDAT_COLUMNS, 64), interval)
     return ddat
 
 
@@ -127,199 +276,212 @@ class DayData:
         self.df = df
         self.interval = interval
         self.current_day = 0
-        self.teq_p = None
-        self.aeq_p = None
-        self.transaction = None
-
-    # Update day data with equilibrium prices and transactions
-    def update_ddat(self, trial, time, traders, n_traders, eq, trade, ndat):
-        def update_arr(arr, value):
-            if not np.isnan(value):
-                if arr is None:
-                    new_arr = np.array(value)
-                else:
-                    new_arr = np.append(arr, value)
-            else:
-                new_arr = arr
-            return new_arr
+        self.teq_p = StreamStats()
+        self.aeq_p = StreamStats()
+        self.transaction = StreamStats()
 
+    # Update day data with equilibrium prices and transactions (trade is NaN if there was none)
+    def update_ddat(self, trial, time, traders, n_traders, eq, trade, ndat, qty=1):
         next_day = self.current_day + 1
         if time > (self.interval * next_day):
             self.end_day(trial, traders, n_traders, ndat, next_day)
             self.init_day()
 
-        self.teq_p = update_arr(self.teq_p, eq[0])
-        self.aeq_p = update_arr(self.aeq_p, eq[2])
-        self.transaction = update_arr(self.transaction, trade)
+        self.teq_p.add(eq[0])
+        self.aeq_p.add(eq[2])
+        self.add_trade(trade, qty)
+
+    # Further trades in the same tick (fills of one shout against several resting orders)
+    def add_trade(self, trade, qty=1):
+        self.transaction.add(trade, qty)
 
     # End-of-day calulcations, update df
     def end_day(self, trial, traders, n_traders, ndat, next_day):
-        def calc_mean(arr):
-            mean = np.nan
-            if arr is not None:
-                mean = np.mean(arr)
-            return mean
-
-        # Calculate Smith's alpha based on price history
-        def calc_alpha(eq, arr):
-            if arr:
-                num = len(arr)
-                sum_sqrd = sum(map(lambda x: (x - eq) ** 2, arr))
-                a = (1.0 / eq) * math.sqrt((1.0 / num) * sum_sqrd)
-            else:
-                a = np.nan
-            return a
-
-        # Calculate best possible alpha value
-        def calc_best_alpha(eq, limit, job):
-            if limit:
-                if job == 'Buy' and limit < teq:
-                    a = (1.0 / teq) * abs(limit - eq)
-                elif job == 'Sell' and limit > teq:
-                    a = (1.0 / teq) * abs(limit - eq)
-                else:
-                    a = 0.0
-            else:
-                a = np.nan
-            return a
-
-        # For each trader, calc Smith's alpha using price history and teq as equilibrium
-        teq = calc_mean(self.teq_p)
-        aeq = calc_mean(self.aeq_p)
-        for n in range(n_traders):
-            bname = 'B%02d' % n
-            alpha = calc_alpha(teq, traders[bname].price_hist)
-            best_alpha = calc_best_alpha(teq, traders[bname].limit, 'Buy')
-            update_ndat(ndat, bname, trial, self.current_day, alpha, best_alpha)
-            traders[bname].reset_price_hist()
-
-            sname = 'S%02d' % n
-            alpha = calc_alpha(teq, traders[sname].price_hist)
-            best_alpha = calc_best_alpha(teq, traders[sname].limit, 'Sell')
-            update_ndat(ndat, sname, trial, self.current_day, alpha, best_alpha)
-            traders[sname].reset_price_hist()
+        # Smith's alpha of every trader at once from their price histories, NaN for traders without one
+        # Squared deviations are summed along each row in order (cumsum), as they would be one trader at a time
+        def calc_alpha(eq, hist, hist_len):
+            alpha = np.full(hist_len.size, np.nan)
+            rows = np.flatnonzero(hist_len)
+            if rows.size:
+                num = hist_len[rows]
+                sqrd = (hist[rows, :num.max()] - eq) ** 2
+                sqrd[np.arange(sqrd.shape[1]) >= num[:, None]] = 0.0
+                sum_sqrd = np.cumsum(sqrd, axis=1)[np.arange(rows.size), num - 1]
+                alpha[rows] = (1.0 / eq) * np.sqrt((1.0 / num) * sum_sqrd)
+            return alpha
+
+        # Best possible alpha value of every trader at once, NaN for traders without a limit
+        def calc_best_alpha(eq, limit):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                worse = np.where(traders.is_sell, limit > eq, limit < eq)
+                return np.where(np.isnan(limit), np.nan, np.where(worse, (1.0 / eq) * np.abs(limit - eq), 0.0))
+
+        # Smith's alpha of each trader using its price history and teq as equilibrium
+        teq = self.teq_p.get_mean()
+        aeq = self.aeq_p.get_mean()
+        alpha = calc_alpha(teq, traders.price_hist, traders.price_hist_len)
+        traders.reset_price_hist()
+        ndat.set_day(self.current_day, alpha, calc_best_alpha(teq, traders.limit))
 
         # Write previous days data to structure containing data for *all* days in trial
-        ddat = {'trialID': trial,
-                'day': self.current_day,
-                'TEQ_P': teq,
-                'AEQ_P': aeq,
-                'Transaction': calc_mean(self.transaction)}
-        ddat_df = self.df.append(ddat, ignore_index=True)
-        self.df = ddat_df
+        trans = self.transaction
+        self.df.append(trial, self.current_day, teq, aeq, trans.get_mean(), trans.get_wmean(), trans.count,
+                       trans.get_min(), trans.get_max(), trans.get_std())
 
         self.current_day = next_day
 
     # Start-of-day initialisations
     def init_day(self):
-        self.teq_p = None
-        self.aeq_p = None
-        self.transaction = None
+        self.teq_p.reset()
+        self.aeq_p.reset()
+        self.transaction.reset()
 
     # Return day data df
     def get_df(self):
-        return self.df
+        return self.df.to_df()
 
 ####################- End of Day Data -####################
 ####################- Network Data -####################
 
 
-# Initialise network data classes
-def init_ndat(traders_spec, n_days):
+# Network data of a trial or the mean over trials: alpha and best possible alpha of every trader on every day, as
+# dense (traders x days) arrays with buyers in rows 0..n-1 and sellers in rows n..2n-1 as in TraderPopulation.
+# With path, the arrays are memory-mapped .npy files in that directory, for runs too long to hold in memory.
+class NetworkData:
+    def __init__(self, n_traders, n_days, path=None):
+        self.n_traders = n_traders
+        self.n_days = n_days
+        shape = (2 * n_traders, n_days)
+        if path is None:
+            self.alpha = np.zeros(shape)
+            self.best = np.ones(shape)
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.alpha = np.lib.format.open_memmap(os.path.join(path, 'alpha.npy'), mode='w+', shape=shape)
+            self.best = np.lib.format.open_memmap(os.path.join(path, 'best.npy'), mode='w+', shape=shape)
+            self.best[:] = 1.0
+
+    # Trader names of rows
+    def get_tnames(self):
+        return ['B%02d' % n for n in range(self.n_traders)] + ['S%02d' % n for n in range(self.n_traders)]
+
+    # Record alpha and best of every trader on a day of a single trial
+    def set_day(self, day, alpha, best):
+        self.alpha[:, day] = alpha
+        self.best[:, day] = best
+
+    # Update mean daily value of alpha and best of every trader with the first n_days_done days of a trial's network
+    # data. Trials must be merged in order for the result not to depend on how trials were run.
+    def update(self, trial_ndat, trial, n_days_done):
+        for mean, values in ((self.alpha, trial_ndat.alpha), (self.best, trial_ndat.best)):
+            old = mean[:, :n_days_done]
+            mean[:, :n_days_done] = (((trial - 1) * old) + values[:, :n_days_done]) / trial
+
+    # DataFrame of nodes start..stop-1, a row per trader (B00, S00, B01, S01, ...) and columns <day>_alpha and
+    # <day>_best
+    def get_df(self, start=0, stop=None):
+        if stop is None:
+            stop = self.n_traders
+        nodes = np.arange(start, stop)
+        rows = np.column_stack((nodes, nodes + self.n_traders)).ravel()
+        tnames = self.get_tnames()
+        columns = {'tname': [tnames[i] for i in rows]}
+        for name, arr in (('alpha', self.alpha), ('best', self.best)):
+            values = arr[rows]
+            for d in range(self.n_days):
+                columns['%d_%s' % (d, name)] = values[:, d]
+        return pd.DataFrame(columns)
+
+    # DataFrames of chunk_size nodes at a time, for writing without building one for the whole network
+    def iter_dfs(self, chunk_size=1000):
+        for start in range(0, self.n_traders, chunk_size):
+            yield self.get_df(start, min(start + chunk_size, self.n_traders))
+
+
+# Initialise network data, memory-mapped in directory path if given
+def init_ndat(traders_spec, n_days, path=None):
     n_traders = sum(n for _, n in traders_spec)
-    ndat_alpha = {}
-    ndat_best = {}
-    for n in range(n_traders):
-        bname = 'B%02d' % n
-        ndat_alpha[bname] = np.zeros(n_days)
-        ndat_best[bname] = np.ones(n_days)
-        sname = 'S%02d' % n
-        ndat_alpha[sname] = np.zeros(n_days)
-        ndat_best[sname] = np.ones(n_days)
-    ndat = {'alpha': ndat_alpha, 'best': ndat_best}
-
-    return ndat
-
-
-# Update mean daily value of alpha and best for each trader
-def update_ndat(ndat, tname, trial, current_day, alpha, best):
-    old_alpha = ndat['alpha'][tname][current_day]
-    new_alpha = (((trial - 1) * old_alpha) + alpha) / trial
-    ndat['alpha'][tname][current_day] = new_alpha
-
-    old_best = ndat['best'][tname][current_day]
-    new_best = (((trial - 1) * old_best) + best) / trial
-    ndat['best'][tname][current_day] = new_best
-
-
-# Update and return network data df
-def get_ndat_df(ndat, n_days, graph):
-    df_alpha = pd.DataFrame.from_dict(ndat['alpha'], orient='index').reset_index()
-    df_best = pd.DataFrame.from_dict(ndat['best'], orient='index').reset_index()
-    df = pd.merge(df_alpha, df_best, on='index')
-
-    df.rename(columns={'index': 'tname'}, inplace=True)
-    df.rename(columns=lambda x: x.replace('x', 'alpha'), inplace=True)
-    df.rename(columns=lambda x: x.replace('y', 'best'), inplace=True)
-
-    return df
-
-
-# Draw network images
-def draw_network(ndat, n_days, buy_network, sell_network, zipfile):
-    def find_values(a, b):
-        d = abs(a - b)
-        new_a = a
-        if np.isnan(new_a):
-            new_a = 1.0
-        return d, new_a
-
-    def draw_graph(graph, d, char, zip_file):
-        colors = [graph.node[x]['alpha'] for x in graph.nodes()]
-        d_dict = dict(nx.degree(graph))
-        sizes = [(v+1) * 70 for v in d_dict.values()]
-        labels_diff = dict([(x, graph.node[x]['diff']) for x in graph.nodes()])
-
-        plt.figure(figsize=(12,9))
-        pos = nx.circular_layout(graph, center=(0, 0))
-        pos_higher = {}
-        for k, v in pos.items():
-            pos_higher[k] = (v[0], v[1] + 0.075)
-        nx.draw_networkx_edges(graph, pos, alpha=0.2)
-        network = nx.draw_networkx_nodes(graph, pos, node_size=sizes, node_color=colors, alpha=0.8, cmap=plt.cm.gist_rainbow_r, vmin=0.0, vmax=0.75)
-        nx.draw_networkx_labels(graph, pos=pos, labels=d_dict, font_color='#cccccc', font_size=14)
-        nx.draw_networkx_labels(graph, pos=pos_higher, labels=labels_diff, font_size=16)
-        cbar = plt.colorbar(network)
-        cbar.ax.tick_params(labelsize=18)
-        plt.axis('off')
-        filename = char + 'network' + str(d) + '.png'
-        plt.savefig(filename, dpi=300, bbox_inches='tight')
-        zip_file.write(filename)
-        os.remove(filename)
-        plt.clf()
-        plt.close('all')
-
-    for n in range(n_days):
-        for tname in ndat['alpha'].keys():
-            nodeid = int(tname[-2:])
-            diff, alpha = find_values(ndat['alpha'][tname][n], ndat['best'][tname][n])
-            if tname[:1] == 'B':
-                buy_network.node[nodeid]['diff'] = float("{0:.3f}".format(diff))
-                buy_network.node[nodeid]['alpha'] = float("{0:.3f}".format(alpha))
-            elif tname[:1] == 'S':
-                sell_network.node[nodeid]['diff'] = float("{0:.3f}".format(diff))
-                sell_network.node[nodeid]['alpha'] = float("{0:.3f}".format(alpha))
-            else:
-                sys.exit('FATAL tname %s is not in correct format.' % tname)
-
-        draw_graph(buy_network, n, 'B', zipfile)
-        draw_graph(sell_network, n, 'S', zipfile)
+    return NetworkData(n_traders, n_days, path)
+
+
+# Network layout, node degrees and sizes for drawing, computed once per network
+# Drawing requires networkx, the topology.Network is converted to a networkx graph
+def get_layout(network):
+    import networkx as nx
+    graph = network.to_networkx()
+    pos = nx.circular_layout(graph, center=(0, 0))
+    pos_higher = {}
+    for k, v in pos.items():
+        pos_higher[k] = (v[0], v[1] + 0.075)
+    d_dict = dict(nx.degree(graph))
+    sizes = [(v+1) * 70 for v in d_dict.values()]
+    return graph, pos, pos_higher, d_dict, sizes
+
+
+# Layouts of the networks being drawn in this process by char ('B'/'S'), set by init_layouts
+layouts = None
+
+
+def init_layouts(graph_layouts):
+    global layouts
+    layouts = graph_layouts
+
+
+# Draw one network image in memory, returns the image file's name and contents
+def render_frame(char, d, colors, labels_diff, dpi, image_format):
+    import networkx as nx
+    graph, pos, pos_higher, d_dict, sizes = layouts[char]
+
+    plt.figure(figsize=(12,9))
+    nx.draw_networkx_edges(graph, pos, alpha=0.2)
+    network = nx.draw_networkx_nodes(graph, pos, node_size=sizes, node_color=colors, alpha=0.8, cmap=plt.cm.gist_rainbow_r, vmin=0.0, vmax=0.75)
+    nx.draw_networkx_labels(graph, pos=pos, labels=d_dict, font_color='#cccccc', font_size=14)
+    nx.draw_networkx_labels(graph, pos=pos_higher, labels=labels_diff, font_size=16)
+    cbar = plt.colorbar(network)
+    cbar.ax.tick_params(labelsize=18)
+    plt.axis('off')
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format=image_format, dpi=dpi, bbox_inches='tight')
+    plt.clf()
+    plt.close('all')
+
+    filename = char + 'network' + str(d) + '.' + image_format
+    return filename, buffer.getvalue()
+
+
+# Draw network images for every k-th day (every) and write them to zipfile, rendering in workers processes
+def draw_network(ndat, n_days, buy_network, sell_network, zipfile, dpi=300, image_format='png', every=1, workers=1):
+    def to_3dp(arr):
+        return [float("{0:.3f}".format(x)) for x in arr]
+
+    networks = {'B': buy_network, 'S': sell_network}
+    rows = {'B': slice(0, ndat.n_traders), 'S': slice(ndat.n_traders, 2 * ndat.n_traders)}
+    frames = []
+    for n in range(0, n_days, every):
+        diff = np.abs(ndat.alpha[:, n] - ndat.best[:, n])
+        alpha = np.where(np.isnan(ndat.alpha[:, n]), 1.0, ndat.alpha[:, n])
+        for char in ('B', 'S'):
+            colors = to_3dp(alpha[rows[char]])
+            labels_diff = dict(enumerate(to_3dp(diff[rows[char]])))
+            frames.append((char, n, colors, labels_diff, dpi, image_format))
+
+    graph_layouts = {char: get_layout(network) for char, network in networks.items()}
+    if frames and workers > 1:
+        with ProcessPoolExecutor(workers, initializer=init_layouts, initargs=(graph_layouts,)) as executor:
+            images = executor.map(render_frame, *zip(*frames))
+            for filename, image in images:
+                zipfile.writestr(filename, image)
+    else:
+        init_layouts(graph_layouts)
+        for frame in frames:
+            filename, image = render_frame(*frame)
+            zipfile.writestr(filename, image)
 
 
 # Write network data adjaceny matrix
 def write_adj_matrix(zipfile, network):
-    nx.write_adjlist(network, 'network.txt')
-    zipfile.write('network.txt')
-    os.remove('network.txt')
+    buffer = io.BytesIO()
+    network.write_adjlist(buffer)
+    zipfile.writestr('network.txt', buffer.getvalue())
 
 ####################- End of Network Data -####################
\ No newline at end of file
@@ -0,0 +1,190 @@
+import numpy as np
+
+import config
+
+
+# Count of quotes at each integer price level, stored as a Fenwick tree so that adding/removing a quote and
+# finding the k-th cheapest quote are both O(log(price levels))
+class PriceLadder:
+    def __init__(self, min_price=config.MIN_PRICE, max_price=config.MAX_PRICE):
+        self.lo = min_price
+        self.hi = max_price
+        self.size = self.hi - self.lo + 1
+        self.counts = [0] * self.size
+        self.tree = [0] * (self.size + 1)
+        self.top_bit = 1 << (self.size.bit_length() - 1)
+        self.total = 0
+
+    def add(self, price, delta):
+        if price < self.lo or price > self.hi:
+            self.grow(price)
+        i = price - self.lo
+        self.counts[i] += delta
+        self.total += delta
+        i += 1
+        tree = self.tree
+        size = self.size
+        while i <= size:
+            tree[i] += delta
+            i += i & -i
+
+    # ZIP prices can drift outside [MIN_PRICE, MAX_PRICE], widen the ladder to cover them
+    def grow(self, price):
+        span = self.size
+        new_lo = min(self.lo, price - span)
+        new_hi = max(self.hi, price + span)
+        counts = [0] * (new_hi - new_lo + 1)
+        offset = self.lo - new_lo
+        counts[offset:offset + self.size] = self.counts
+
+        self.lo = new_lo
+        self.hi = new_hi
+        self.size = new_hi - new_lo + 1
+        self.counts = counts
+        self.top_bit = 1 << (self.size.bit_length() - 1)
+        self.tree = [0] + counts
+        for i in range(1, self.size + 1):
+            j = i + (i & -i)
+            if j <= self.size:
+                self.tree[j] += self.tree[i]
+
+    # k-th lowest price (0-based) in the ladder
+    def kth_smallest(self, k):
+        pos = 0
+        rem = k + 1
+        step = self.top_bit
+        tree = self.tree
+        size = self.size
+        while step:
+            nxt = pos + step
+            if nxt <= size and tree[nxt] < rem:
+                pos = nxt
+                rem -= tree[nxt]
+            step >>= 1
+        return pos + self.lo
+
+    # k-th highest price (0-based) in the ladder
+    def kth_largest(self, k):
+        return self.kth_smallest(self.total - 1 - k)
+
+
+# Keeps price ladders of active buyer/seller quotes and limits up to date as agents change state, so that
+# theoretical and actual equilibrium can be found without sorting every trader on every tick.
+# Agents call sync() whenever add_order, set_price or del_order change their quote, listeners (e.g.
+# CounterpartyIndex) get quote_changed(trader) whenever an active quote/limit actually changes.
+class EqTracker:
+    def __init__(self, listeners=()):
+        self.b_price = PriceLadder()
+        self.b_limit = PriceLadder()
+        self.s_price = PriceLadder()
+        self.s_limit = PriceLadder()
+        self.quotes = {}
+        self.dirty = set()
+        self.listeners = list(listeners)
+        self.eq = [np.nan, np.nan, np.nan, np.nan]
+        self.population = None
+
+    # Attach tracker to traders (a TraderPopulation) and register their current state
+    def attach(self, traders):
+        self.population = traders
+        traders.tracker = self
+        for trader in traders.values():
+            trader.tracker = self
+            self.sync(trader)
+
+    # Bring ladders in line with trader's current quote
+    def sync(self, trader):
+        self.dirty.add(trader)
+
+        tid = trader.tid
+        old = self.quotes.get(tid)
+        new = (trader.price, trader.limit) if trader.active else None
+        if old == new:
+            return
+
+        if trader.job == 'Buy':
+            price_ladder = self.b_price
+            limit_ladder = self.b_limit
+        else:
+            price_ladder = self.s_price
+            limit_ladder = self.s_limit
+
+        if old is not None:
+            price_ladder.add(old[0], -1)
+            limit_ladder.add(old[1], -1)
+        if new is not None:
+            price_ladder.add(new[0], 1)
+            limit_ladder.add(new[1], 1)
+            self.quotes[tid] = new
+        else:
+            del self.quotes[tid]
+
+        for listener in self.listeners:
+            listener.quote_changed(trader)
+
+    # Price may have changed since price_hist was last updated
+    def touch(self, trader):
+        self.dirty.add(trader)
+
+    def touch_all(self):
+        self.dirty.update(self.population.agents)
+
+    # Same result as data.find_eq, price_hist only updated for traders touched since last call
+    # The same list is returned every time, updated in place
+    def find_eq(self):
+        def find_intersect(bl, sl):
+            bnum = bl.total
+            snum = sl.total
+
+            # no active buyers or active sellers
+            if bnum == 0 or snum == 0:
+                return np.nan, np.nan
+            # lowest selling price > highest buying price -> no intersection
+            if sl.kth_smallest(0) > bl.kth_largest(0):
+                return np.nan, np.nan
+
+            # bid/ask gap widens with q, binary search for first q where they cross
+            max_q = min(bnum, snum)
+            lo = 1
+            hi = max_q
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if sl.kth_smallest(mid) > bl.kth_largest(mid):
+                    hi = mid
+                else:
+                    lo = mid + 1
+
+            if lo < max_q:
+                # straightforward intersection
+                q = lo
+                price = (sl.kth_smallest(q - 1) + bl.kth_largest(q - 1)) * 0.5
+                quant = q
+            else:
+                q = max_q - 1
+                # last buyer, last seller
+                if bnum == snum:
+                    price = (sl.kth_smallest(q) + bl.kth_largest(q)) * 0.5
+                elif max_q == bnum:
+                    price = (sl.kth_smallest(q) + sl.kth_smallest(q + 1)) * 0.5
+                else:
+                    price = (bl.kth_largest(q) + bl.kth_largest(q + 1)) * 0.5
+                quant = max_q
+
+            return price, quant
+
+        dirty = self.dirty
+        if dirty:
+            self.population.record_prices(np.fromiter([trader.idx for trader in dirty], np.intp, len(dirty)))
+            dirty.clear()
+
+        # Find actual equilibrium from trade limit prices
+        aeq_p, aeq_q = find_intersect(self.b_price, self.s_price)
+        # Find theoretical equilibrium from trade limit prices
+        teq_p, teq_q = find_intersect(self.b_limit, self.s_limit)
+
+        eq = self.eq
+        eq[0] = teq_p
+        eq[1] = teq_q
+        eq[2] = aeq_p
+        eq[3] = aeq_q
+        return eq
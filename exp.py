@@ -1,13 +1,26 @@
 import os
 import sys
+import random
+import argparse
+import functools
+import itertools
 import zipfile
-import pandas as pd
 import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 import setup
 import session
 import expctl
 import data
+import batch
+import streams
+import instrument
+import livefeed
+import warmstart
+from checkpoint import Checkpoints
+from population import TraderPopulation
 
 logging.basicConfig(
     format='%(asctime)s %(levelname)-8s %(message)s',
@@ -15,58 +28,280 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S')
 logger = logging.getLogger(__name__)
 
-if __name__ == '__main__':
-    input_file = sys.argv[1]
-    filename, file_ext = os.path.splitext(os.path.basename(input_file))
+# Parameters and network shared by all trials run in this process, checkpoints of the experiment, the warm start
+# snapshot of its traders and the live feed trials publish to (if any), set by init_market
+market = None
+checkpoints = None
+snapshot = None
+feed = None
 
-    zip_name = filename + '.zip'
-    zip_file = zipfile.ZipFile(zip_name, 'w')
 
-    # Set up parameters for the session
-    params = expctl.get_params(input_file)
+def init_market(params, n_traders, buy_network, sell_network, experiment_checkpoints=None, warm_snapshot=None,
+                live_feed=None):
+    global market, checkpoints, snapshot, feed
+    market = (params, n_traders, buy_network, sell_network)
+    checkpoints = experiment_checkpoints
+    snapshot = warm_snapshot
+    feed = live_feed
+
+
+# Independent, reproducible random seed for each trial derived from the master seed
+def get_trial_seeds(seed, n_trials):
+    return [int(s.generate_state(1, np.uint64)[0]) for s in np.random.SeedSequence(seed).spawn(n_trials)]
 
-    # Initialise dataframes to contain trading and daily data
-    ddat_df = pd.DataFrame()
-    tdat_df = pd.DataFrame()
+
+# Run a single trial on the market set by init_market
+# Returns day and trading data dfs, the trial's network data, number of days it completed and instrumentation report
+# (None unless params['instrument'])
+def run_trial(trial, seed):
+    params, n_traders, buy_network, sell_network = market
+    state = None
+    save_state = None
+    if checkpoints is not None:
+        state = checkpoints.load_state(trial)
+        save_state = functools.partial(checkpoints.save_state, trial)
+
+    if state is None:
+        random.seed(seed)
+        # numpy block streams and common random numbers both draw order flow, initial agent parameters, trader
+        # selection, quotes and matching from their own streams
+        if params['rng'] == 'numpy':
+            streams.seed_blocks(seed)
+        elif params['crn']:
+            streams.seed_all(seed)
+        else:
+            streams.reset()
+
+        # Initialise traders
+        traders = TraderPopulation(n_traders)
+        init_verbose = False
+        setup.populate_market(params['traders_spec'], traders, buy_network, sell_network, init_verbose)
+        if snapshot is not None:
+            warmstart.apply(traders, snapshot, params['warm_start'][1])
+        trial_ndat = data.init_ndat(params['traders_spec'], params['n_days'])
+        inst = instrument.Instruments() if params['instrument'] else None
+    else:
+        # Continue from the end of the last day checkpointed
+        traders = state['traders']
+        trial_ndat = state['ndat']
+        inst = state['inst']
+
+    ddat, tdat = session.run(trial, params['start'],
+                             params['end'], params['order_sched'],
+                             traders, n_traders,
+                             trial_ndat, buy_network, sell_network,
+                             params['zip_update'], params['update_scope'], inst, save_state, state, feed,
+                             params['clearing'])
+    report = inst.report(trial) if inst is not None else None
+    result = (ddat, tdat, trial_ndat, len(ddat), report)
+    if checkpoints is not None:
+        checkpoints.save_result(trial, result)
+    return result
+
+
+# Run a batch of trials in lockstep on the market set by init_market, returns a list of run_trial results
+def run_batch(trials, seeds):
+    params, n_traders, buy_network, sell_network = market
+    rng = np.random.default_rng(list(seeds))
+    results = batch.run(list(trials), params, n_traders, buy_network, sell_network, rng, snapshot)
+    if checkpoints is not None:
+        for trial, result in zip(trials, results):
+            checkpoints.save_result(trial, result)
+    return results
+
+
+# Run all trials of an experiment and write results to zip_file
+# The master seed fixes the network and every trial, results are the same whatever the number of workers
+# draw_opts are passed on to data.draw_network
+# With batch_size > 0 trials are run batch_size at a time in lockstep by batch.run, results then depend on batch_size
+# With checkpoint_dir, finished trials and the state of unfinished ones at the end of each day are saved there. If
+# resume, an experiment stopped part way through continues from its checkpoints, with the same results as an
+# uninterrupted run. Checkpoints are removed once the experiment has finished.
+# If params['warm_start'] is [days, perturb] with days > 0, ZIP traders start every trial from their state after a
+# days long burn-in of the market (see warmstart), cached in warm_cache if given
+# With ndat_dir, network data averaged over trials is kept in memory-mapped files in that directory
+# With feed_address (see livefeed.parse_address) trials publish a live feed of the market there, trials must then be
+# run one at a time in this process
+def run_experiment(params, seed, zip_file, workers=1, draw_graphs=True, draw_opts=None, batch_size=0,
+                   checkpoint_dir=None, resume=False, warm_cache=None, ndat_dir=None, feed_address=None):
+    if feed_address is not None and (workers > 1 or batch_size > 0):
+        sys.exit('FATAL: a live feed needs trials run one at a time, without --workers or --batch')
+    random.seed(seed)
+    trial_seeds = get_trial_seeds(seed, params['n_trials'])
 
     # Initialise network
     logger.info('Creating network')
     (n_traders, buy_network, sell_network) = setup.build_network(params['traders_spec'], params['network'])
     data.write_adj_matrix(zip_file, buy_network)
-    ndat = data.init_ndat(params['traders_spec'], params['n_days'])
+    # The master seed is kept with the results, rerunning with --seed reproduces them
+    zip_file.writestr('seed.txt', '%d\n' % seed)
+    ndat = data.init_ndat(params['traders_spec'], params['n_days'], ndat_dir)
+    reports = []
+
+    warm_snapshot = None
+    if params['warm_start'][0] > 0:
+        logger.info('Warm start after %d burn-in days' % params['warm_start'][0])
+        warm_snapshot = warmstart.get_snapshot(params, n_traders, buy_network, sell_network, params['warm_start'][0],
+                                               warm_cache)
+
+    experiment_checkpoints = None
+    if checkpoint_dir is not None:
+        experiment_checkpoints = Checkpoints(checkpoint_dir)
+        experiment_checkpoints.start(params, seed, batch_size, resume)
 
     # Run sequence of trials, 1 session per trial
-    trial = 1
+    # With workers the network is sent to each worker process once, when it starts
+    # Trials with results in checkpoints are not run again
+    trials = range(1, params['n_trials'] + 1)
+    if batch_size > 0:
+        run = run_batch
+        jobs = [(trials[i:i + batch_size], trial_seeds[i:i + batch_size]) for i in range(0, len(trials), batch_size)]
+    else:
+        run = run_trial
+        jobs = [([trial], [trial_seed]) for trial, trial_seed in zip(trials, trial_seeds)]
+    if experiment_checkpoints is not None:
+        jobs = [job for job in jobs if not all(experiment_checkpoints.has_result(trial) for trial in job[0])]
+    todo = set(trial for job in jobs for trial in job[0])
+    if batch_size == 0:
+        jobs = [(job[0][0], job[1][0]) for job in jobs]
+
+    live_feed = None
+    if feed_address is not None:
+        live_feed = livefeed.Feed(feed_address)
+        live_feed.start()
+
     logger.info('Running NLSE experiments')
-    while trial < params['n_trials'] + 1:
-        logger.info('Running %s' % trial)
-        # Initialise traders
-        traders = {}
-        init_verbose = False
-        setup.populate_market(params['traders_spec'], traders, buy_network, sell_network, init_verbose)
-        ddat, tdat = session.run(trial, params['start'],
-                                 params['end'], params['order_sched'],
-                                 traders, n_traders,
-                                 ndat, buy_network, sell_network)
-        # Add trading and day data from trial to df
-        ddat_df = ddat_df.append(ddat)
-        tdat_df = tdat_df.append(tdat)
-        ndat_df = data.get_ndat_df(ndat, params['n_days'], buy_network)
-        trial += 1
-
-    logger.info('Experiments finished')
-
-    # Write dataframes to csv and to zipfile
-    logger.info('Writing day data to csv...')
-    zip_file.writestr('ddat.csv', ddat_df.to_csv(index=False))
-    logger.info('Writing trading data to csv...')
-    zip_file.writestr('tdat.csv', tdat_df.to_csv(index=False))
-    logger.info('Writing network data to csv...')
-    zip_file.writestr('ndat.csv', ndat_df.to_csv(index=False))
-    # Draw network graphs and write to zipfile
-    logger.info('Drawing network graphs...')
-    data.draw_network(ndat, params['n_days'], buy_network, sell_network, zip_file)
-
-    zip_file.close()
-    sys.exit('Complete')
+    if workers > 1:
+        executor = ProcessPoolExecutor(workers, initializer=init_market,
+                                       initargs=(params, n_traders, buy_network, sell_network, experiment_checkpoints,
+                                                 warm_snapshot))
+        results = executor.map(run, *zip(*jobs)) if jobs else iter([])
+    else:
+        executor = None
+        init_market(params, n_traders, buy_network, sell_network, experiment_checkpoints, warm_snapshot, live_feed)
+        results = map(run, *zip(*jobs)) if jobs else iter([])
+    if batch_size > 0:
+        results = itertools.chain.from_iterable(results)
+
+    # Trading and daily data are written to the zipfile as each trial finishes. If a trial fails the sink is still
+    # closed, so the zipfile keeps the trials finished before it.
+    sink = data.ResultSink(zip_file, direct='tdat.csv')
+    try:
+        for trial in trials:
+            if trial in todo:
+                ddat, tdat, trial_ndat, n_days_done, report = next(results)
+            else:
+                ddat, tdat, trial_ndat, n_days_done, report = experiment_checkpoints.load_result(trial)
+            logger.info('Finished %s' % trial)
+            # Write trading and day data from trial, add network data to mean over trials
+            sink.write('ddat.csv', ddat)
+            sink.write('tdat.csv', tdat)
+            ndat.update(trial_ndat, trial, n_days_done)
+            if report is not None:
+                reports.append(report)
+
+        if executor is not None:
+            executor.shutdown()
+        if live_feed is not None:
+            live_feed.close()
+        logger.info('Experiments finished')
+
+        # Write network data to csv and finish writing csvs to zipfile
+        logger.info('Writing network data to csv...')
+        for ndat_df in ndat.iter_dfs():
+            sink.write('ndat.csv', ndat_df)
+    finally:
+        sink.close()
+    if reports:
+        instrument.write_report(zip_file, reports)
+    if experiment_checkpoints is not None:
+        experiment_checkpoints.clear()
+    if draw_graphs:
+        # Draw network graphs and write to zipfile
+        logger.info('Drawing network graphs...')
+        data.draw_network(ndat, params['n_days'], buy_network, sell_network, zip_file, workers=workers,
+                          **(draw_opts or {}))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a networked market experiment')
+    parser.add_argument('input_file', help='experiment file')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes to run trials in')
+    parser.add_argument('--seed', type=int, default=None, help='master random seed')
+    parser.add_argument('--crn', action='store_true',
+                        help='common random numbers: same order flow, initial agents and trader selection for any '
+                             'network with the same seed')
+    parser.add_argument('--batch', type=int, default=0,
+                        help='run trials in lockstep batches of this size (ZIC/ZIP markets only)')
+    parser.add_argument('--rng', choices=('python', 'numpy'), default=None,
+                        help='random numbers from the random module or from block-buffered numpy streams')
+    parser.add_argument('--instrument', action='store_true',
+                        help='time each phase of the tick loop and count events, report in instrument.csv/json')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='save finished trials and the state of running trials at the end of each day')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an experiment from its checkpoints (implies --checkpoint)')
+    parser.add_argument('--checkpoint-dir', default=None,
+                        help='directory of checkpoints, default <experiment file name>_checkpoint')
+    parser.add_argument('--warm-start', type=int, default=None,
+                        help='start ZIP traders from their state after this many burn-in days of the market')
+    parser.add_argument('--perturb', type=float, default=None,
+                        help='with --warm-start, scale each starting margin by a random factor within 1 +/- this')
+    parser.add_argument('--warm-cache', default='warm_cache', help='directory of cached warm start snapshots')
+    parser.add_argument('--ndat-dir', default=None,
+                        help='keep network data (alpha/best per trader per day) in memory-mapped files here')
+    parser.add_argument('--feed', default=None,
+                        help='publish shouts, trades and daily summaries live on unix:PATH or tcp:HOST:PORT')
+    parser.add_argument('--clearing', choices=('bilateral', 'cda', 'cda-network'), default=None,
+                        help='clear shouts with a random willing neighbour (bilateral) or on a limit order book '
+                             '(cda, cda-network: only between neighbours)')
+    parser.add_argument('--no-draw', action='store_true', help='don\'t draw network images')
+    parser.add_argument('--draw-every', type=int, default=1, help='only draw network images for every k-th day')
+    parser.add_argument('--dpi', type=int, default=300, help='resolution of network images')
+    parser.add_argument('--image-format', default='png', help='format of network images, e.g. png, svg, pdf')
+    args = parser.parse_args()
+    if args.draw_every < 1:
+        sys.exit('FATAL: --draw-every must be at least 1, got %d' % args.draw_every)
 
+    input_file = args.input_file
+    filename, file_ext = os.path.splitext(os.path.basename(input_file))
+
+    zip_name = filename + '.zip'
+    zip_file = zipfile.ZipFile(zip_name, 'w')
+
+    # Set up parameters for the session
+    params = expctl.get_params(input_file)
+    if args.crn:
+        params['crn'] = True
+    if args.instrument:
+        params['instrument'] = True
+    if args.rng is not None:
+        params['rng'] = args.rng
+    if args.warm_start is not None:
+        params['warm_start'][0] = args.warm_start
+    if args.perturb is not None:
+        params['warm_start'][1] = args.perturb
+    if args.clearing is not None:
+        params['clearing'] = args.clearing
+
+    checkpoint_dir = None
+    if args.checkpoint or args.resume:
+        checkpoint_dir = args.checkpoint_dir or filename + '_checkpoint'
+
+    seed = args.seed
+    if seed is None and args.resume:
+        seed = Checkpoints(checkpoint_dir).get_seed()
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(63)
+        logger.warning('Master seed %d (rerun with --seed %d to reproduce)' % (seed, seed))
+    else:
+        logger.info('Master seed %d' % seed)
+
+    try:
+        run_experiment(params, seed, zip_file, args.workers, not args.no_draw,
+                       {'dpi': args.dpi, 'image_format': args.image_format, 'every': args.draw_every}, args.batch,
+                       checkpoint_dir, args.resume, args.warm_cache, args.ndat_dir, args.feed)
+    finally:
+        # Also when the experiment fails, so the results written so far stay readable
+        zip_file.close()
+    sys.exit('Complete')
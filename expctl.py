@@ -14,6 +14,15 @@ def get_params(filename):
     interval = None
     start_time = 0.0
     end_time = None
+    zip_update = 'batch'
+    update_scope = 'global'
+    hops = 0
+    crn = False
+    rng = 'python'
+    instrument = False
+    warm_start = 0
+    perturb = 0.0
+    clearing = 'bilateral'
 
     def get_sched(ls, x):
         start = int(ls[x + 1]) * interval
@@ -43,12 +52,34 @@ def get_params(filename):
                     k = int(lines[i+3])
                 elif network_type == 'SF':
                     k = int(lines[i+2])
+                elif network_type == 'File':
+                    p = lines[i+2].strip()
             elif line.startswith('#order_interval'):
                 interval = float(lines[i + 1])
                 order_schedule['interval'] = interval
             elif line.startswith('#days'):
                 days = int(lines[i + 1])
                 end_time = days * interval
+            elif line.startswith('#zip_update'):
+                zip_update = lines[i + 1].strip('\n')
+            elif line.startswith('#update_scope'):
+                update_scope = lines[i + 1].strip('\n')
+                if update_scope == 'k-hop':
+                    hops = int(lines[i + 2])
+            elif line.startswith('#crn'):
+                crn = lines[i + 1].strip() in ('True', 'true', 'on', '1')
+            elif line.startswith('#rng'):
+                rng = lines[i + 1].strip()
+            elif line.startswith('#instrument'):
+                instrument = lines[i + 1].strip() in ('True', 'true', 'on', '1')
+            elif line.startswith('#warm_start'):
+                warm_start = int(lines[i + 1])
+                perturb = float(lines[i + 2])
+            elif line.startswith('#clearing'):
+                clearing = lines[i + 1].strip()
+            elif line.startswith('#order_qty'):
+                qty = [int(q) for q in lines[i + 1].split()]
+                order_schedule['qty'] = qty[0] if len(qty) == 1 else qty
             elif line.startswith('#order_timemode'):
                 order_schedule['timemode'] = lines[i + 1].strip('\n')
             elif line.startswith('#demand_schedule'):
@@ -71,5 +102,12 @@ def get_params(filename):
               'start': start_time,
               'end': end_time,
               'traders_spec': traders_spec,
-              'order_sched': order_schedule}
+              'order_sched': order_schedule,
+              'zip_update': zip_update,
+              'update_scope': [update_scope, hops],
+              'crn': crn,
+              'rng': rng,
+              'instrument': instrument,
+              'warm_start': [warm_start, perturb],
+              'clearing': clearing}
     return params
@@ -0,0 +1,66 @@
+import json
+import time
+import zipfile
+
+import pandas as pd
+
+# Optional per-trial instrumentation of session.run: wall time spent in each phase of the tick loop and counts of
+# what happened in it. session.run only touches an Instruments when given one, so runs without --instrument pay
+# nothing but a check for None per phase.
+PHASES = ('customer_orders', 'find_eq', 'select', 'process_order', 'bookkeep', 'update_traders', 'update_ddat')
+COUNTERS = ('ticks', 'shouts', 'deals', 'no_deals', 'zip_repricings', 'orders_issued')
+
+
+class Instruments:
+    def __init__(self):
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.start_time = None
+        self.last = None
+        self.wall = 0.0
+
+    def start(self):
+        self.start_time = self.last = time.perf_counter()
+
+    # Charge the time since the previous lap (or mark) to phase
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.times[phase] += now - self.last
+        self.last = now
+
+    # Start timing from now without charging the time since the previous lap to any phase
+    def mark(self):
+        self.last = time.perf_counter()
+
+    def count(self, counter, n=1):
+        self.counts[counter] += n
+
+    # Wall time is added up over start/stop pairs, so a run resumed from a checkpoint reports its total
+    def stop(self):
+        self.wall += time.perf_counter() - self.start_time
+
+    # Flat dict of results for trial
+    def report(self, trial):
+        row = {'trial': trial, 'wall_time': self.wall,
+               'ticks_per_sec': self.counts['ticks'] / self.wall if self.wall > 0 else float('nan')}
+        for phase in PHASES:
+            row['time_' + phase] = self.times[phase]
+        row.update(self.counts)
+        return row
+
+
+# Write per-trial reports to zip_file as instrument.csv and instrument.json, the json with totals over all trials
+def write_report(zip_file, reports):
+    df = pd.DataFrame(reports)
+    total = {column: float(df[column].sum()) for column in df.columns if column.startswith('time_')}
+    total['wall_time'] = float(df['wall_time'].sum())
+    total.update({counter: int(df[counter].sum()) for counter in COUNTERS})
+    total['ticks_per_sec'] = total['ticks'] / total['wall_time'] if total['wall_time'] > 0 else float('nan')
+
+    date_time = time.localtime()[:6]
+    info = zipfile.ZipInfo('instrument.csv', date_time=date_time)
+    info.compress_type = zip_file.compression
+    zip_file.writestr(info, df.to_csv(index=False))
+    info = zipfile.ZipInfo('instrument.json', date_time=date_time)
+    info.compress_type = zip_file.compression
+    zip_file.writestr(info, json.dumps({'trials': reports, 'total': total}, indent=2))
@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import socket
+import asyncio
+import argparse
+import itertools
+import threading
+import collections
+
+import data
+
+# Live feed of a running market: session.run publishes shouts, trades and end-of-day summaries to a Feed, which
+# serves them as JSON lines to any number of subscribers on a local Unix socket or TCP port.
+# publish() only appends a tuple to a bounded queue, everything else (serialising, writing to sockets) happens on
+# an asyncio event loop in a background thread that drains the queue every interval seconds, so the tick loop is
+# never held up by subscribers. When the queue is full the oldest messages are dropped; every message carries a
+# sequence number so subscribers can see gaps. A subscriber whose socket buffer holds more than buffer_limit bytes
+# is skipped: its shouts and trades are dropped (it is sent a 'dropped' message with their count once it has caught
+# up) and its end-of-day summaries are coalesced into the latest one.
+# Watch a feed with
+#   python livefeed.py unix:/tmp/nlse.sock
+FIELDS = {'shout': ('trial', 'time', 'tid', 'otype', 'price', 'status'),
+          'trade': ('trial', 'time', 'price', 'buyer', 'seller'),
+          'day': tuple(name for name, _ in data.DDAT_COLUMNS)}
+
+
+# ('unix', path) or ('tcp', (host, port)) from 'unix:PATH' or 'tcp:HOST:PORT'
+def parse_address(address):
+    kind, _, rest = address.partition(':')
+    if kind == 'unix' and rest:
+        return kind, rest
+    if kind == 'tcp':
+        host, _, port = rest.rpartition(':')
+        if host and port.isdigit():
+            return kind, (host, int(port))
+    sys.exit('FATAL: feed address %s is neither unix:PATH nor tcp:HOST:PORT' % address)
+
+
+def encode(msg):
+    return (json.dumps(msg, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+# JSON line of a published message, NaN (e.g. no trades in a day) becomes null
+def encode_message(seq, msg):
+    row = {'seq': seq, 'type': msg[0]}
+    for name, value in zip(FIELDS[msg[0]], msg[1:]):
+        if hasattr(value, 'item'):
+            value = value.item()
+        row[name] = None if isinstance(value, float) and value != value else value
+    return encode(row)
+
+
+class Subscriber:
+    def __init__(self, writer, buffer_limit):
+        self.writer = writer
+        self.task = asyncio.current_task()
+        self.buffer_limit = buffer_limit
+        self.dropped = 0
+        self.pending_day = None
+
+    def is_slow(self):
+        return self.writer.transport.get_write_buffer_size() > self.buffer_limit
+
+    # Send what was held back while the subscriber was slow, once it no longer is
+    def catch_up(self):
+        if (self.dropped or self.pending_day) and not self.is_slow():
+            if self.dropped:
+                self.writer.write(encode({'type': 'dropped', 'count': self.dropped}))
+                self.dropped = 0
+            if self.pending_day:
+                self.writer.write(self.pending_day)
+                self.pending_day = None
+
+    def send(self, line, is_day):
+        self.catch_up()
+        if not self.is_slow():
+            self.writer.write(line)
+        elif is_day:
+            self.pending_day = line
+        else:
+            self.dropped += 1
+
+
+class Feed:
+    def __init__(self, address, queue_size=100000, buffer_limit=1 << 20, interval=0.05, close_timeout=2.0):
+        self.kind, self.address = parse_address(address)
+        self.queue = collections.deque(maxlen=queue_size)
+        self.seq = itertools.count()
+        self.buffer_limit = buffer_limit
+        self.interval = interval
+        self.close_timeout = close_timeout
+        self.subscribers = set()
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.stopping = None
+
+    # Queue a message (type, values...) with values in the order of FIELDS[type], never blocks
+    def publish(self, msg):
+        self.queue.append((next(self.seq), msg))
+
+    # Start serving in a background thread, returns once the socket is listening
+    def start(self):
+        ready = threading.Event()
+        errors = []
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            try:
+                self.loop.run_until_complete(self.listen())
+            except OSError as e:
+                errors.append(e)
+                ready.set()
+                return
+            ready.set()
+            self.loop.run_until_complete(self.pump())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=serve, name='livefeed', daemon=True)
+        self.thread.start()
+        ready.wait()
+        if errors:
+            sys.exit('FATAL: cannot serve feed on %s: %s' % (self.address, errors[0]))
+
+    async def listen(self):
+        self.stopping = asyncio.Event()
+        if self.kind == 'unix':
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            self.server = await asyncio.start_unix_server(self.subscribe, self.address)
+        else:
+            self.server = await asyncio.start_server(self.subscribe, *self.address)
+
+    async def subscribe(self, reader, writer):
+        subscriber = Subscriber(writer, self.buffer_limit)
+        self.subscribers.add(subscriber)
+        try:
+            # Subscribers only listen, reading until they disconnect
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+        self.subscribers.discard(subscriber)
+        writer.close()
+
+    def flush(self):
+        queue = self.queue
+        while queue:
+            seq, msg = queue.popleft()
+            if self.subscribers:
+                line = encode_message(seq, msg)
+                for subscriber in list(self.subscribers):
+                    subscriber.send(line, msg[0] == 'day')
+        for subscriber in list(self.subscribers):
+            subscriber.catch_up()
+
+    async def pump(self):
+        while not self.stopping.is_set():
+            self.flush()
+            try:
+                await asyncio.wait_for(self.stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+        # Send what is left and an end message, give subscribers a moment to receive them before disconnecting
+        self.flush()
+        self.server.close()
+        subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.catch_up()
+            subscriber.writer.write(encode({'type': 'end'}))
+            subscriber.writer.close()
+        if subscribers:
+            _, pending = await asyncio.wait([subscriber.task for subscriber in subscribers], timeout=self.close_timeout)
+            for subscriber in subscribers:
+                if subscriber.task in pending:
+                    subscriber.writer.transport.abort()
+            if pending:
+                await asyncio.wait(pending)
+        await self.server.wait_closed()
+
+    # Stop serving after sending all queued messages
+    def close(self):
+        if self.thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.stopping.set)
+        self.thread.join()
+        self.thread = None
+        if self.kind == 'unix' and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+# Print the messages of a feed until it ends
+def watch(address):
+    kind, address = parse_address(address)
+    if kind == 'unix':
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(address)
+    with sock, sock.makefile('r') as f:
+        for line in f:
+            sys.stdout.write(line)
+            if json.loads(line)['type'] == 'end':
+                break
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the live feed of a running experiment')
+    parser.add_argument('address', help='unix:PATH or tcp:HOST:PORT given to exp.py --feed')
+    args = parser.parse_args()
+    watch(args.address)
@@ -1,5 +1,6 @@
 # Order has a trader id, type (bid/ask), price, quantity, time it was issued and status (pending/accepted/rejected)
 class Order:
+    __slots__ = ('tid', 'otype', 'price', 'qty', 'status', 'time')
 
     def __init__(self, tid, otype, price, qty, status, time):
         self.tid = tid
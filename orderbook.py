@@ -0,0 +1,140 @@
+import heapq
+
+import numpy as np
+
+# Limit order book of a continuous double auction, an alternative to session.process_order's bilateral matching.
+# Each trader has at most one resting order, its latest shout. A shout first cancels the trader's resting order,
+# then trades with resting orders on the other side that it crosses, best price first and oldest first at the same
+# price, each at the resting order's price. Whatever quantity is left rests on the book.
+# Entries are lists [key, seq, tid, qty, price, agent, customer order, nodeid, otype], key being -price for bids
+# and price for asks. A resting order lapses once its trader no longer holds the customer order it was shouted for
+# (it has been filled or replaced by a new customer order), lapsed and cancelled entries are dropped lazily.
+# Unrestricted, bids and asks are heaps and submitting, cancelling and each fill take O(log n).
+# If restricted, a shout can only trade with resting orders of traders at neighbouring nodes: buyers with sellers
+# in sell_network, sellers with buyers in buy_network. As each node has one buyer and one seller, resting orders are
+# then kept per node and side, and a shout only looks at its neighbours' orders, O(degree) whatever the book size.
+KEY, SEQ, TID, QTY, PRICE, AGENT, ORDER, NODE, OTYPE = range(9)
+
+
+class OrderBook:
+    def __init__(self, buy_network=None, sell_network=None, restricted=False):
+        self.bids = []
+        self.asks = []
+        self.resting = {}  # tid -> live entry
+        self.seq = 0
+        self.networks = {'Bid': sell_network, 'Ask': buy_network}
+        self.restricted = restricted
+        if restricted:
+            # Price (NaN if none), seq and entry of the resting order at each node on each side
+            n_nodes = buy_network.number_of_nodes()
+            self.node_price = {otype: np.full(n_nodes, np.nan) for otype in ('Bid', 'Ask')}
+            self.node_seq = {otype: np.zeros(n_nodes, dtype=np.int64) for otype in ('Bid', 'Ask')}
+            self.node_entry = {otype: [None] * n_nodes for otype in ('Bid', 'Ask')}
+
+    def __len__(self):
+        return len(self.resting)
+
+    def cancel(self, tid):
+        entry = self.resting.get(tid)
+        if entry is not None:
+            self.remove(entry)
+
+    def remove(self, entry):
+        if self.resting.get(entry[TID]) is entry:
+            del self.resting[entry[TID]]
+        if self.restricted:
+            otype = entry[OTYPE]
+            node = entry[NODE]
+            if self.node_entry[otype][node] is entry:
+                self.node_entry[otype][node] = None
+                self.node_price[otype][node] = np.nan
+
+    def is_live(self, entry):
+        agent = entry[AGENT]
+        return self.resting.get(entry[TID]) is entry and agent.order is entry[ORDER] and agent.active
+
+    # Shout order (a Bid or Ask of agent) at the book
+    # Returns fills as a list of (counterparty agent, price, qty), the unfilled quantity rests on the book
+    def submit(self, order, agent):
+        self.cancel(order.tid)
+        fills = []
+        if self.restricted:
+            qty = self.match_neighbours(order, agent, fills)
+        else:
+            qty = self.match(order, fills)
+
+        if qty > 0:
+            key = -order.price if order.otype == 'Bid' else order.price
+            entry = [key, self.seq, order.tid, qty, order.price, agent, agent.order, agent.nodeid, order.otype]
+            self.seq += 1
+            self.resting[order.tid] = entry
+            if self.restricted:
+                self.node_price[order.otype][agent.nodeid] = order.price
+                self.node_seq[order.otype][agent.nodeid] = entry[SEQ]
+                self.node_entry[order.otype][agent.nodeid] = entry
+            else:
+                side = self.bids if order.otype == 'Bid' else self.asks
+                heapq.heappush(side, entry)
+                self.compact(side)
+        return fills
+
+    # Fill against one resting entry, returns the quantity of the shout left
+    def fill(self, entry, qty, fills):
+        filled = min(qty, entry[QTY])
+        fills.append((entry[AGENT], entry[PRICE], filled))
+        entry[QTY] -= filled
+        return qty - filled
+
+    # Match against the top of the opposite heap
+    def match(self, order, fills):
+        if order.otype == 'Bid':
+            opposite = self.asks
+            crosses = order.price.__ge__
+        else:
+            opposite = self.bids
+            crosses = order.price.__le__
+        qty = order.qty
+        while qty > 0 and opposite:
+            entry = opposite[0]
+            if not self.is_live(entry):
+                self.remove(heapq.heappop(opposite))
+                continue
+            if not crosses(entry[PRICE]):
+                break
+            qty = self.fill(entry, qty, fills)
+            if entry[QTY] == 0:
+                self.remove(heapq.heappop(opposite))
+        return qty
+
+    # Match against the resting orders of the shouting trader's neighbours, in price-time order
+    def match_neighbours(self, order, agent, fills):
+        otype = 'Ask' if order.otype == 'Bid' else 'Bid'
+        nodes = self.networks[order.otype].neighbors(agent.nodeid)
+        prices = self.node_price[otype][nodes]
+        if order.otype == 'Bid':
+            crossing = prices <= order.price
+            keys = prices[crossing]
+        else:
+            crossing = prices >= order.price
+            keys = -prices[crossing]
+        nodes = nodes[crossing]
+        qty = order.qty
+        if nodes.size:
+            priority = np.lexsort((self.node_seq[otype][nodes], keys))
+            for node in nodes[priority].tolist():
+                entry = self.node_entry[otype][node]
+                if not self.is_live(entry):
+                    self.remove(entry)
+                    continue
+                qty = self.fill(entry, qty, fills)
+                if entry[QTY] == 0:
+                    self.remove(entry)
+                if qty == 0:
+                    break
+        return qty
+
+    # Rebuild a side from its live entries once most of it is cancelled or lapsed
+    def compact(self, side):
+        if len(side) > 2 * len(self.resting) + 64:
+            side[:] = [entry for entry in side if self.is_live(entry)]
+            heapq.heapify(side)
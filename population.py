@@ -0,0 +1,153 @@
+import numpy as np
+
+JOBS = ('Buy', 'Sell')
+
+
+# Property on an agent that reads/writes its row of a TraderPopulation array
+def array_property(name, cast=float, nullable=False):
+    def getter(self):
+        value = getattr(self.population, name)[self.idx]
+        if nullable and np.isnan(value):
+            return None
+        return cast(value)
+
+    def setter(self, value):
+        if nullable and value is None:
+            value = np.nan
+        getattr(self.population, name)[self.idx] = value
+
+    return property(getter, setter)
+
+
+# Agent state shared by ZIC and ZIP, backed by TraderPopulation arrays
+class PopulationView:
+    limit = array_property('limit', int, nullable=True)
+    price = array_property('price', int, nullable=True)
+    active = array_property('active', bool)
+    balance = array_property('balance')
+
+    def bind(self, population, job, nodeid):
+        # Stand-alone agents get a population of their own
+        if population is None:
+            population = TraderPopulation(nodeid + 1)
+        self.population = population
+        self.idx = population.index(job, nodeid)
+        population.job[self.idx] = JOBS.index(job)
+        population.add(self)
+
+    @property
+    def job(self):
+        return JOBS[self.population.job[self.idx]]
+
+    # Today's price history, a view of the agent's row of the population's buffer
+    @property
+    def price_hist(self):
+        return self.population.price_hist[self.idx, :self.population.price_hist_len[self.idx]]
+
+
+# Struct-of-arrays store of trader state for a market of n_traders buyers and n_traders sellers.
+# Buyers occupy rows 0..n-1 and sellers rows n..2n-1, row = index(job, nodeid).
+# Also behaves like the tname -> agent dict used elsewhere.
+# Each trader's price history for the day (its quote whenever it changed) is held in row i of price_hist, the first
+# price_hist_len[i] entries. The buffer is kept across days and widened when a history outgrows it.
+class TraderPopulation:
+    def __init__(self, n_traders, hist_capacity=64):
+        self.n_traders = n_traders
+        size = 2 * n_traders
+        self.limit = np.full(size, np.nan)
+        self.price = np.full(size, np.nan)
+        self.margin = np.zeros(size)
+        self.beta = np.zeros(size)
+        self.momentum = np.zeros(size)
+        self.prev_change = np.zeros(size)
+        self.c_abs = np.zeros(size)
+        self.c_rel = np.zeros(size)
+        self.is_zip = np.zeros(size, dtype=bool)
+        self.active = np.zeros(size, dtype=bool)
+        self.balance = np.zeros(size)
+        self.job = np.zeros(size, dtype=np.int8)
+        self.is_sell = np.arange(size) >= n_traders
+        self.is_buy = ~self.is_sell
+        self.masks = np.zeros((3, size), dtype=bool)  # scratch space for agentZIP.batch_update
+        self.price_hist = np.zeros((size, hist_capacity))
+        self.price_hist_len = np.zeros(size, dtype=np.intp)
+        self.tracker = None  # EqTracker attached to the traders
+        self.agents = [None] * size
+        self.tids = {}
+
+    def index(self, job, nodeid):
+        if job == 'Buy':
+            return nodeid
+        return self.n_traders + nodeid
+
+    def add(self, agent):
+        self.agents[agent.idx] = agent
+        self.tids[agent.tid] = agent
+
+    def reserve_hist(self, capacity):
+        if capacity > self.price_hist.shape[1]:
+            price_hist = np.zeros((self.price_hist.shape[0], max(capacity, 2 * self.price_hist.shape[1])))
+            price_hist[:, :self.price_hist.shape[1]] = self.price_hist
+            self.price_hist = price_hist
+
+    # Add the current quote of the trader in row i to its price history, unless it is the last one there
+    def record_price(self, i):
+        price = self.price[i]
+        if not np.isnan(price):
+            n = self.price_hist_len[i]
+            if n == 0 or self.price_hist[i, n - 1] != price:
+                self.reserve_hist(n + 1)
+                self.price_hist[i, n] = price
+                self.price_hist_len[i] = n + 1
+
+    # record_price for an array of distinct rows at once
+    def record_prices(self, rows):
+        price = self.price[rows]
+        n = self.price_hist_len[rows]
+        last = self.price_hist[rows, np.maximum(n - 1, 0)]
+        new = ~np.isnan(price) & ((n == 0) | (price != last))
+        if new.any():
+            rows = rows[new]
+            n = n[new]
+            self.reserve_hist(n.max() + 1)
+            self.price_hist[rows, n] = price[new]
+            self.price_hist_len[rows] = n + 1
+
+    # Start every trader's price history afresh, each records its quote again at the next find_eq
+    def reset_price_hist(self):
+        self.price_hist_len[:] = 0
+        if self.tracker is not None:
+            self.tracker.touch_all()
+
+    def buyer(self, nodeid):
+        return self.agents[nodeid]
+
+    def seller(self, nodeid):
+        return self.agents[self.n_traders + nodeid]
+
+    # dict-like access by trader name
+    def __getitem__(self, tid):
+        return self.tids[tid]
+
+    def __setitem__(self, tid, agent):
+        if agent.population is not self:
+            raise ValueError('agent %s does not belong to this population' % tid)
+        self.tids[tid] = agent
+
+    def __contains__(self, tid):
+        return tid in self.tids
+
+    def __iter__(self):
+        return iter(self.tids)
+
+    def __len__(self):
+        return len(self.tids)
+
+    def keys(self):
+        return self.tids.keys()
+
+    def values(self):
+        return self.tids.values()
+
+    def items(self):
+        return self.tids.items()
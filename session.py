@@ -1,13 +1,29 @@
 import sys
+import heapq
 import random
 import numpy as np
 
 import config
 import data
+import streams
+from agentZIP import batch_update
+from counterparty import CounterpartyIndex
+from eqtracker import EqTracker
 from order import Order
+from orderbook import OrderBook
 
 
+# Pending (to-be-issued) customer orders are a heap of (issue_time, n, order), n being the order's position in the
+# list of orders generated with it
+# Customer orders are for order_sched['qty'] units (1 if not given), or a number drawn uniformly from qty = [min, max]
+# for each order. Bilateral matching trades them a unit at a time, an order book can fill them partly.
 def customer_orders(time, traders, n_traders, order_sched, pending, verbose):
+    orders_rng = streams.get('orders')
+    qty = order_sched.get('qty', 1)
+    min_qty, max_qty = (qty, qty) if isinstance(qty, int) else qty
+    if min_qty < 1 or max_qty < min_qty:
+        sys.exit('FATAL: order quantity %s is not a positive number or [min, max] range in customer_orders()' % qty)
+
     def get_issue_times(num_traders, timemode, interval, fit_to_interval, shuffle):
         interval = float(interval)
 
@@ -27,9 +43,9 @@ def customer_orders(time, traders, n_traders, order_sched, pending, verbose):
             elif timemode == 'drip-fixed':
                 arrival_time = n * timestep
             elif timemode == 'drip-jitter':
-                arrival_time = n * timestep + timestep * random.random()
+                arrival_time = n * timestep + timestep * orders_rng.random()
             elif timemode == 'drip-poisson':
-                inter_arrival_time = random.expovariate(num_traders / interval)
+                inter_arrival_time = orders_rng.expovariate(num_traders / interval)
                 arrival_time += inter_arrival_time
             else:
                 sys.exit('FATAL: unknown timemode in get_issue_times()')
@@ -46,7 +62,7 @@ def customer_orders(time, traders, n_traders, order_sched, pending, verbose):
         if shuffle:
             for n in range(num_traders):
                 i = (num_traders - 1) - n
-                j = random.randint(0, i)
+                j = orders_rng.randint(0, i)
                 tmp = times[i]
                 times[i] = times[j]
                 times[j] = tmp
@@ -109,14 +125,14 @@ def customer_orders(time, traders, n_traders, order_sched, pending, verbose):
         if s_mode == 'fixed':
             price = min_price + int(trader * step)
         elif s_mode == 'jittered':
-            price = min_price + int(trader * step) + random.randint(-half_step, half_step)
+            price = min_price + int(trader * step) + orders_rng.randint(-half_step, half_step)
         elif s_mode == 'random':
             # # More than one schedule, choose one equiprobably
             # if len(s_range) > 1:
             #     s = random.randint(0, len(s_range) - 1)
             #     min_price = sysmin_check(min(s_range[s][0], s_range[s][1]))
             #     max_price = sysmax_check(max(s_range[s][0], s_range[s][1]))
-            price = random.randint(min_price, max_price)
+            price = orders_rng.randint(min_price, max_price)
         else:
             sys.exit('FATAL: Unknown mode in schedule in get_order_price()')
         price = sysmin_check(sysmax_check(price))
@@ -139,8 +155,9 @@ def customer_orders(time, traders, n_traders, order_sched, pending, verbose):
             issue_time = time + issue_times[t]
             tname = 'B%02d' % t
             oprice = get_order_price(t, sched_range, n_traders, mode)
-            order = Order(tname, otype, oprice, 1, 'Pending', issue_time)
-            new_pending.append(order)
+            oqty = min_qty if min_qty == max_qty else orders_rng.randint(min_qty, max_qty)
+            order = Order(tname, otype, oprice, oqty, 'Pending', issue_time)
+            new_pending.append((issue_time, len(new_pending), order))
 
         # SELLERS (supply-side)
         issue_times = get_issue_times(n_traders, order_sched['timemode'], order_sched['interval'],
@@ -152,115 +169,303 @@ def customer_orders(time, traders, n_traders, order_sched, pending, verbose):
             issue_time = time + issue_times[t]
             tname = 'S%02d' % t
             oprice = get_order_price(t, sched_range, n_traders, mode)
-            order = Order(tname, otype, oprice, 1, 'Pending', issue_time)
-            new_pending.append(order)
+            oqty = min_qty if min_qty == max_qty else orders_rng.randint(min_qty, max_qty)
+            order = Order(tname, otype, oprice, oqty, 'Pending', issue_time)
+            new_pending.append((issue_time, len(new_pending), order))
+
+        heapq.heapify(new_pending)
 
     # List of pending orders not empty so issues any to traders where issue_time is in the past
     else:
-        new_pending = []
-        for order in pending:
-            if time > order.time:
-                # issue_time is in the past so issue order to trader
-                tname = order.tid
-                traders[tname].add_order(order)
-                if verbose:
-                    print('New order issued: %s' % traders[tname].order)
-            # Only add order to new_pending if issue_time is in the past
-            else:
-                new_pending.append(order)
+        new_pending = pending
+        due = []
+        while new_pending and new_pending[0][0] < time:
+            due.append(heapq.heappop(new_pending))
+        # Issue in the order orders were generated in
+        due.sort(key=lambda item: item[1])
+        for _, _, order in due:
+            # issue_time is in the past so issue order to trader
+            tname = order.tid
+            traders[tname].add_order(order)
+            if verbose:
+                print('New order issued: %s' % traders[tname].order)
 
     return new_pending
 
 
-def process_order(order, time, traders, buy_network, sell_network, verbose):
+# Time at which the next pending customer order is due, None if there are none left
+def next_issue_time(pending):
+    if pending:
+        return pending[0][0]
+    return None
+
+
+# If asks/bids (CounterpartyIndex of sellers/buyers) are given, willing counterparties are found from them rather
+# than by checking every neighbour
+# Sets order status, returns the counterparty agent or None if no neighbour is willing to deal
+def process_order(order, time, traders, buy_network, sell_network, verbose, asks=None, bids=None):
     # Form a list of agents willing to deal
-    def get_willing(price, traders, neighbors, char):
+    def get_willing(price, neighbors, get_trader):
         willing_list = []
-        for n in neighbors:
-            tname = char % n
-            if traders[tname].willing_to_trade(price):
-                willing_list.append(tname)
+        for n in neighbors.tolist():
+            trader = get_trader(n)
+            if trader.willing_to_trade(price):
+                willing_list.append(trader)
         return willing_list
 
     nodeid = traders[order.tid].nodeid
-    if order.otype == 'Bid':
-        neighbors = list(sell_network.neighbors(nodeid))
-        willing = get_willing(order.price, traders, neighbors, 'S%02d')
-    elif order.otype == 'Ask':
-        neighbors = list(buy_network.neighbors(nodeid))
-        willing = get_willing(order.price, traders, neighbors, 'B%02d')
-    else:
+    if order.otype not in ('Bid', 'Ask'):
         sys.exit('FATAL: order type is neither Bid or Ask in process_order()\n')
 
-    if len(willing) > 0:
+    if asks is not None and bids is not None:
+        index = asks if order.otype == 'Bid' else bids
+        counterparty = index.choose(nodeid, order.price)
+    else:
+        if order.otype == 'Bid':
+            willing = get_willing(order.price, sell_network.neighbors(nodeid), traders.seller)
+        else:
+            willing = get_willing(order.price, buy_network.neighbors(nodeid), traders.buyer)
+        counterparty = streams.get('matching').choice(willing) if willing else None
+
+    if counterparty is not None:
         order.status = 'Deal'
-        counterparty = random.choice(willing)
-        transaction_record = {'time': time,
-                              'price': order.price,
-                              'party1': counterparty,
-                              'party2': order.tid,
-                              'qty': order.qty}
         if verbose:
-            print('>>>>>>>>>>>>>>>>>TRADE t=%5.2f $%d %s %s' % (time, order.price, counterparty, order.tid))
+            print('>>>>>>>>>>>>>>>>>TRADE t=%5.2f $%d %s %s' % (time, order.price, counterparty.tid, order.tid))
     else:
         order.status = 'NoDeal'
-        transaction_record = None
         if verbose:
             print('************* NO TRADE t=%5.2f $%d %s' % (time, order.price, order.tid))
 
-    return transaction_record
-
-
-def update_traders(order, traders, n_traders, buy_network, sell_network, verbose):
-    nodeid = traders[order.tid].nodeid
-    neighbors = set()
-
-    neighbors.update(buy_network.neighbors(nodeid))
-    neighbors.update(sell_network.neighbors(nodeid))
-    neighbors.add(nodeid)
+    return counterparty
 
-    for n in range(n_traders):
-        bname = 'B%02d' % n
-        sname = 'S%02d' % n
-        traders[bname].update(order.price, order.otype, order.status, verbose)
-        traders[sname].update(order.price, order.otype, order.status, verbose)
 
+# Clears order on a limit order book (orderbook.OrderBook) rather than with a neighbour: it trades with the resting
+# orders it crosses, at their prices, and any quantity left rests on the book
+# Sets order status, returns fills as a list of (counterparty agent, price, qty)
+def process_order_book(order, time, trader, book, verbose):
+    if order.otype not in ('Bid', 'Ask'):
+        sys.exit('FATAL: order type is neither Bid or Ask in process_order_book()\n')
 
-def run(trial, start_time, end_time, order_sched, traders, n_traders, ndat, buy_network, sell_network):
+    fills = book.submit(order, trader)
+    if fills:
+        order.status = 'Deal'
+        if verbose:
+            for counterparty, price, qty in fills:
+                print('>>>>>>>>>>>>>>>>>TRADE t=%5.2f $%d x%d %s %s' % (time, price, qty, counterparty.tid, order.tid))
+    else:
+        order.status = 'NoDeal'
+        if verbose:
+            print('************* NO TRADE t=%5.2f $%d %s (resting)' % (time, order.price, order.tid))
+
+    return fills
+
+
+# Sorted node ids within hops of nodeid in either network, found from their CSR adjacency
+def get_neighborhood(nodeid, buy_network, sell_network, hops):
+    csrs = [(buy_network.indptr, buy_network.indices)]
+    if sell_network is not buy_network:
+        csrs.append((sell_network.indptr, sell_network.indices))
+
+    hood = np.array([nodeid])
+    frontier = hood
+    for _ in range(hops):
+        reached = [indices[indptr[v]:indptr[v + 1]] for indptr, indices in csrs for v in frontier]
+        frontier = np.setdiff1d(np.concatenate(reached), hood)
+        if frontier.size == 0:
+            break
+        hood = np.union1d(hood, frontier)
+    return hood
+
+
+# zip_update is 'scalar' (AgentZIP.update per trader), 'batch' (batch_update, same results as scalar for a given
+# seed) or 'batch-numpy' (batch_update with perturbations drawn from zip_rng).
+# update_scope is [mode, k]: 'global' updates every trader in the market, 'neighbors' only buyers and sellers at
+# the shouting node and its neighbours, 'k-hop' those within k hops of it.
+# Traders update on oprice, the shout's trade price if it traded (order.price if None).
+# Returns the number of traders whose quote price changed.
+def update_traders(order, traders, n_traders, buy_network, sell_network, verbose, zip_update='batch', zip_rng=None,
+                   update_scope=('global', 0), oprice=None):
+    if oprice is None:
+        oprice = order.price
+    if update_scope[0] == 'global':
+        nodes = range(n_traders)
+        rows = None
+    else:
+        if update_scope[0] == 'neighbors':
+            hops = 1
+        elif update_scope[0] == 'k-hop':
+            hops = update_scope[1]
+        else:
+            sys.exit('FATAL: unknown update scope %s in update_traders()' % update_scope[0])
+        nodes = get_neighborhood(traders[order.tid].nodeid, buy_network, sell_network, hops)
+        rows = np.concatenate((nodes, nodes + n_traders))
+
+    if zip_update == 'scalar' or verbose:
+        old_price = traders.price.copy()
+        for n in nodes:
+            traders.buyer(n).update(oprice, order.otype, order.status, verbose)
+            traders.seller(n).update(oprice, order.otype, order.status, verbose)
+        return np.count_nonzero((traders.price != old_price) & ~np.isnan(old_price))
+    else:
+        # ZIC update() does nothing, so only ZIP rows need updating
+        repriced = batch_update(traders, oprice, order.otype, order.status, zip_rng, rows)
+        for i in repriced:
+            trader = traders.agents[i]
+            if trader.tracker is not None:
+                trader.tracker.sync(trader)
+        return len(repriced)
+
+
+# Run one trial, ndat receives the trial's alpha/best for each trader on each completed day
+# If inst (instrument.Instruments) is given, time spent in each phase of a tick and counts of events are added to it
+# If checkpoint is given it is called with the state of the session at the end of each day. Passing that state back
+# in (with its traders and ndat) continues the session from there, with the same results as an uninterrupted run.
+# If feed (livefeed.Feed) is given, shouts, trades and end-of-day summaries are published to it
+# clearing is 'bilateral' (a shout trades at its price with a random willing neighbour, process_order), 'cda' (a
+# continuous double auction on a limit order book, process_order_book) or 'cda-network' (the same, but shouts only
+# trade with resting orders of neighbours). A shout's trade price, which ZIP traders update on, is the price of the
+# last resting order it traded with.
+def run(trial, start_time, end_time, order_sched, traders, n_traders, ndat, buy_network, sell_network,
+        zip_update='batch', update_scope=('global', 0), inst=None, checkpoint=None, state=None, feed=None,
+        clearing='bilateral'):
     orders_verbose = False
     trade_verbose = False
     update_verbose = False
     bookkeep_verbose = False
 
-    # Initialise trading data + day data
-    tdat = data.init_tdat()
-    ddat = data.init_ddat(order_sched['interval'])
-
     timestep = 1.0 / float(n_traders * 2)  # TODO: need to check this
-    time = start_time
 
-    pending_orders = []
+    if state is None:
+        # Initialise trading data + day data
+        tdat = data.init_tdat()
+        ddat = data.init_ddat(order_sched['interval'])
 
-    while time <= end_time:
+        time = start_time
+
+        pending_orders = []
+
+        if zip_update == 'batch-numpy':
+            zip_rng = np.random.default_rng(random.getrandbits(64))
+        elif zip_update in ('batch', 'scalar'):
+            zip_rng = None
+        else:
+            sys.exit('FATAL: unknown zip_update mode %s in run()' % zip_update)
+
+        # Track active quotes/limits incrementally rather than re-sorting all traders every tick, and index
+        # neighbours' quotes by price for matching
+        asks = CounterpartyIndex(traders, sell_network, 'Sell')
+        bids = CounterpartyIndex(traders, buy_network, 'Buy')
+        eq_tracker = EqTracker([asks, bids])
+        eq_tracker.attach(traders)
+        eq = None
         trade_price = np.nan
 
-        pending_orders = customer_orders(time, traders, n_traders, order_sched, pending_orders, orders_verbose)
-        eq = data.find_eq(traders, n_traders)
+        if clearing == 'bilateral':
+            book = None
+        elif clearing in ('cda', 'cda-network'):
+            book = OrderBook(buy_network, sell_network, clearing == 'cda-network')
+        else:
+            sys.exit('FATAL: unknown clearing mode %s in run()' % clearing)
+    else:
+        streams.set_state(state['rng'])
+        tdat = state['tdat']
+        ddat = state['ddat']
+        time = state['time']
+        pending_orders = state['pending_orders']
+        zip_rng = state['zip_rng']
+        eq_tracker = state['eq_tracker']
+        asks, bids = eq_tracker.listeners
+        eq = state['eq']
+        trade_price = state['trade_price']
+        book = state['book']
+
+    selection_rng = streams.get('selection')
+    day = ddat.current_day
+
+    if inst is not None:
+        inst.start()
+    while time <= end_time:
+        trade_price = np.nan
+        if inst is not None:
+            inst.count('ticks')
+            inst.mark()
+
+        # Only generate or issue customer orders if some are due
+        next_issue = next_issue_time(pending_orders)
+        if next_issue is None or next_issue < time:
+            n_pending = len(pending_orders)
+            pending_orders = customer_orders(time, traders, n_traders, order_sched, pending_orders, orders_verbose)
+            if inst is not None and n_pending:
+                inst.count('orders_issued', n_pending - len(pending_orders))
+        if inst is not None:
+            inst.lap('customer_orders')
+        eq = eq_tracker.find_eq()
+        if inst is not None:
+            inst.lap('find_eq')
 
         # Get shout (order) from randomly chosen trader
-        tid = random.choice(list(traders.keys()))
-        order = traders[tid].get_order(time)
+        trader = selection_rng.choice(traders.agents)
+        order = trader.get_order(time)
+        if inst is not None:
+            inst.lap('select')
         if order is not None:
-            trade = process_order(order, time, traders, buy_network, sell_network, trade_verbose)
-            if trade is not None:
-                traders[trade['party1']].bookkeep(trade, bookkeep_verbose)
-                traders[trade['party2']].bookkeep(trade, bookkeep_verbose)
-                trade_price = trade['price']
-                tdat = data.update_tdat(tdat, trial, time, eq, trade_price)
-            update_traders(order, traders, n_traders, buy_network, sell_network, update_verbose)
-            ddat.update_ddat(trial, time, traders, n_traders, eq, trade_price, ndat)
+            if book is None:
+                counterparty = process_order(order, time, traders, buy_network, sell_network, trade_verbose, asks,
+                                             bids)
+                fills = () if counterparty is None else ((counterparty, order.price, 1),)
+            else:
+                fills = process_order_book(order, time, trader, book, trade_verbose)
+            if inst is not None:
+                inst.lap('process_order')
+                inst.count('shouts')
+                inst.count('deals' if fills else 'no_deals')
+            if feed is not None:
+                feed.publish(('shout', trial, time, order.tid, order.otype, order.price, order.status))
+            if fills:
+                for counterparty, price, qty in fills:
+                    if feed is not None:
+                        if order.otype == 'Bid':
+                            feed.publish(('trade', trial, time, price, order.tid, counterparty.tid))
+                        else:
+                            feed.publish(('trade', trial, time, price, counterparty.tid, order.tid))
+                    counterparty.bookkeep(price, bookkeep_verbose, qty)
+                    trader.bookkeep(price, bookkeep_verbose, qty)
+                    tdat = data.update_tdat(tdat, trial, time, eq, price)
+                _, trade_price, trade_qty = fills[-1]
+                if inst is not None:
+                    inst.lap('bookkeep')
+            repriced = update_traders(order, traders, n_traders, buy_network, sell_network, update_verbose, zip_update,
+                                      zip_rng, update_scope, trade_price if fills else None)
+            if inst is not None:
+                inst.lap('update_traders')
+                inst.count('zip_repricings', repriced)
+            if fills:
+                ddat.update_ddat(trial, time, traders, n_traders, eq, trade_price, ndat, trade_qty)
+                for _, price, qty in fills[:-1]:
+                    ddat.add_trade(price, qty)
+            else:
+                ddat.update_ddat(trial, time, traders, n_traders, eq, trade_price, ndat)
+            if inst is not None:
+                inst.lap('update_ddat')
         time += timestep
 
+        if (checkpoint is not None or feed is not None) and ddat.current_day != day:
+            day = ddat.current_day
+            if feed is not None:
+                feed.publish(('day',) + ddat.df.last())
+            if checkpoint is not None:
+                if inst is not None:
+                    inst.stop()
+                checkpoint({'traders': traders, 'ndat': ndat, 'inst': inst, 'tdat': tdat, 'ddat': ddat, 'time': time,
+                            'pending_orders': pending_orders, 'zip_rng': zip_rng, 'eq_tracker': eq_tracker, 'eq': eq,
+                            'trade_price': trade_price, 'book': book, 'rng': streams.get_state()})
+                if inst is not None:
+                    inst.start()
+
     ddat.update_ddat(trial, time, traders, n_traders, eq, trade_price, ndat)
+    if feed is not None and ddat.current_day != day:
+        feed.publish(('day',) + ddat.df.last())
+    if inst is not None:
+        inst.stop()
     ddat_df = ddat.get_df()
-    return ddat_df, tdat
+    return ddat_df, tdat.to_df()
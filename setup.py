@@ -1,55 +1,67 @@
-import random
 import sys
-import networkx as nx
-import numpy as np
+
+import streams
+import topology
 
 from agentZIP import AgentZIP
 from agentZIC import AgentZIC
+from population import TraderPopulation
 
 
-# Build graph of traders, identical graphs for seller and buyer communities
+# Build network of traders, one topology.Network shared by the seller and buyer communities
+# Generated networks need networkx, 'File' networks are loaded from the file network[1] (see topology.load)
 def build_network(traders_spec, network):
     # n_traders equal to number of each trader type (buyers OR sellers), half of total number of traders
     n_traders = sum(n for _, n in traders_spec)
 
-    if network[0] == 'FC':
-        buyers_network = nx.complete_graph(n_traders)
-    elif network[0] == 'Random':
-        buyers_network = nx.fast_gnp_random_graph(n_traders, network[1])
-    elif network[0] == 'SW':
-        buyers_network = nx.watts_strogatz_graph(n_traders, network[2], network[1])
-    elif network[0] == 'SF':
-        buyers_network = nx.barabasi_albert_graph(n_traders, network[2])
+    if network[0] == 'File':
+        buyers_network = topology.load(network[1], n_traders)
+        if buyers_network.number_of_nodes() != n_traders:
+            sys.exit('FATAL: network in %s has %d nodes, traders_spec has %d traders per side'
+                     % (network[1], buyers_network.number_of_nodes(), n_traders))
     else:
-        sys.exit('FATAL: don\'t know robot type %s\n' % network)
+        import networkx as nx
+        if network[0] == 'FC':
+            graph = nx.complete_graph(n_traders)
+        elif network[0] == 'Random':
+            graph = nx.fast_gnp_random_graph(n_traders, network[1])
+        elif network[0] == 'SW':
+            graph = nx.watts_strogatz_graph(n_traders, network[2], network[1])
+        elif network[0] == 'SF':
+            graph = nx.barabasi_albert_graph(n_traders, network[2])
+        else:
+            sys.exit('FATAL: don\'t know robot type %s\n' % network)
+        buyers_network = topology.from_networkx(graph)
 
-    sellers_network = buyers_network.copy()
+    sellers_network = buyers_network
     return n_traders, buyers_network, sellers_network
 
 
-def initialise_agent(ttype, tname, node_id, job):
+def initialise_agent(ttype, tname, node_id, job, population=None):
     if ttype == 'ZIP':
         if job == 'Buy':
-            margin = -0.01 * random.randrange(5, 36)
-            return AgentZIP('ZIP', tname, node_id, job, margin)
+            margin = -0.01 * streams.get('agents').randrange(5, 36)
+            return AgentZIP('ZIP', tname, node_id, job, margin, population)
         else:
-            margin = 0.01 * random.randrange(5, 36)
-            return AgentZIP('ZIP', tname, node_id, job, margin)
+            margin = 0.01 * streams.get('agents').randrange(5, 36)
+            return AgentZIP('ZIP', tname, node_id, job, margin, population)
     elif ttype == 'ZIC':
-        return AgentZIC('ZIC', tname, node_id, job)
+        return AgentZIC('ZIC', tname, node_id, job, population)
     else:
         sys.exit('FATAL: agent type %s does not exit %s\n' % ttype)
 
 
 def populate_market(traders_spec, traders, buyers_network, sellers_network, verbose):
+    # traders is a TraderPopulation (or a plain dict, in which case agents get stand-alone state)
+    population = traders if isinstance(traders, TraderPopulation) else None
+
     # Initialise buyers
     n_buyers = 0
     for ts in traders_spec:
         ttype = ts[0]
         for i in range(ts[1]):
             tname = 'B%02d' % n_buyers  # Set buyer ID string
-            traders[tname] = initialise_agent(ttype, tname, n_buyers, 'Buy')
-            buyers_network.node[n_buyers]['tname'] = tname
+            traders[tname] = initialise_agent(ttype, tname, n_buyers, 'Buy', population)
             n_buyers += 1
 
     if n_buyers < 1:
@@ -66,8 +78,7 @@ def populate_market(traders_spec, traders, buyers_network, sellers_network, verb
         ttype = ts[0]
         for i in range(ts[1]):
             tname = 'S%02d' % n_sellers  # Set seller ID string
-            traders[tname] = initialise_agent(ttype, tname, n_sellers, 'Sell')
-            sellers_network.node[n_sellers]['tname'] = tname
+            traders[tname] = initialise_agent(ttype, tname, n_sellers, 'Sell', population)
             n_sellers += 1
 
     if n_sellers < 1:
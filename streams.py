@@ -0,0 +1,110 @@
+import random
+import numpy as np
+
+# Named random number streams.
+# By default every stream is the global random module. In common random numbers (CRN) mode each stream is a
+# separate generator seeded from the trial seed and its name, so the draws of one stream don't depend on how many
+# draws were taken from the others. Experiments that differ only in the network then see the same order flow,
+# initial agent parameters and trader selection sequence.
+# In numpy mode each stream is a BlockRNG, independent streams as in CRN mode but with numbers drawn in bulk.
+#   'orders': customer order issue times and prices (session.customer_orders)
+#   'agents': initial ZIP margin, beta and momentum (setup.initialise_agent, AgentZIP)
+#   'selection': trader chosen to shout each tick (session.run)
+#   'quotes': ZIC quote prices and ZIP target price perturbations (AgentZIC.set_price, AgentZIP.update)
+#   'matching': counterparty chosen from willing traders (session.process_order)
+NAMES = ('orders', 'agents', 'selection', 'quotes', 'matching')
+
+active = {}
+
+
+# Drop-in for the parts of random.Random used by the simulation, backed by a numpy Generator.
+# Uniforms and exponentials are generated block_size at a time and handed out one by one, integers and choices
+# are derived from the uniforms.
+class BlockRNG:
+    def __init__(self, seed_seq, block_size=4096):
+        self.generator = np.random.Generator(np.random.PCG64(seed_seq))
+        self.block_size = block_size
+        self.uniforms = []
+        self.u_pos = 0
+        self.exponentials = []
+        self.e_pos = 0
+
+    def random(self):
+        if self.u_pos == len(self.uniforms):
+            self.uniforms = self.generator.random(self.block_size).tolist()
+            self.u_pos = 0
+        u = self.uniforms[self.u_pos]
+        self.u_pos += 1
+        return u
+
+    # n uniforms as an array, the same numbers n calls of random() would return
+    def random_array(self, n):
+        out = np.empty(n)
+        filled = 0
+        while filled < n:
+            if self.u_pos == len(self.uniforms):
+                self.uniforms = self.generator.random(max(self.block_size, n - filled)).tolist()
+                self.u_pos = 0
+            take = min(n - filled, len(self.uniforms) - self.u_pos)
+            out[filled:filled + take] = self.uniforms[self.u_pos:self.u_pos + take]
+            self.u_pos += take
+            filled += take
+        return out
+
+    def randrange(self, start, stop=None):
+        if stop is None:
+            start, stop = 0, start
+        return start + int(self.random() * (stop - start))
+
+    def randint(self, a, b):
+        return a + int(self.random() * (b - a + 1))
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+    def expovariate(self, lambd):
+        if self.e_pos == len(self.exponentials):
+            self.exponentials = self.generator.standard_exponential(self.block_size).tolist()
+            self.e_pos = 0
+        e = self.exponentials[self.e_pos]
+        self.e_pos += 1
+        return e / lambd
+
+
+def get(name):
+    return active.get(name, random)
+
+
+# n uniforms from stream as an array
+def random_array(stream, n):
+    if isinstance(stream, BlockRNG):
+        return stream.random_array(n)
+    return np.array([stream.random() for _ in range(n)])
+
+
+# Give each stream its own generator seeded from seed
+def seed_all(seed):
+    for name in NAMES:
+        active[name] = random.Random('%d:%s' % (seed, name))
+
+
+# Give each stream its own block-buffered numpy generator seeded from seed
+def seed_blocks(seed):
+    for n, name in enumerate(NAMES):
+        active[name] = BlockRNG(np.random.SeedSequence(seed, spawn_key=(n,)))
+
+
+# Draw every stream from the global random module again
+def reset():
+    active.clear()
+
+
+# State of the random module and every stream, for checkpoints
+def get_state():
+    return {'random': random.getstate(), 'active': dict(active)}
+
+
+def set_state(state):
+    random.setstate(state['random'])
+    active.clear()
+    active.update(state['active'])
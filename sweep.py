@@ -0,0 +1,126 @@
+import os
+import sys
+import copy
+import json
+import hashlib
+import argparse
+import itertools
+import zipfile
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import exp
+import expctl
+import version
+
+logger = logging.getLogger(__name__)
+
+# Parameter sweeps: a base experiment file in the expctl.get_params format plus a grid of overrides, e.g.
+#   {"network": [["FC", 0, 0], ["SW", 0.1, 4]], "order_sched.timemode": ["drip-poisson", "periodic"]}
+# Keys are params keys, with '.' to reach into nested dicts. Every combination of values is a cell, run as an
+# experiment with the same master seed. Cell results are cached under a hash of (params, seed, code version), so a
+# sweep only runs cells that are new or changed. Warm start snapshots of cells are cached in the warm subdirectory.
+
+
+# Demand/supply schedules are bounded in time, i.e. days x the base interval (see expctl.get_sched). Schedules left
+# as in params are moved to the same days at the cell's interval, and one running to the end of the base
+# experiment runs to the end of the cell, however many days it has.
+def rescale_schedules(params, cell):
+    scale = cell['order_sched']['interval'] / params['order_sched']['interval']
+    for side in ('dem', 'sup'):
+        scheds = cell['order_sched'].get(side)
+        if scheds is None or scheds != params['order_sched'].get(side):
+            continue
+        for sched in scheds:
+            to_end = sched['to'] >= params['end']
+            sched['from'] = sched['from'] * scale
+            sched['to'] = cell['end'] if to_end else sched['to'] * scale
+
+
+# Copy of params with overrides applied
+def apply_overrides(params, overrides):
+    cell = copy.deepcopy(params)
+    for key, value in overrides.items():
+        target = cell
+        path = key.split('.')
+        for name in path[:-1]:
+            target = target[name]
+        if path[-1] not in target:
+            sys.exit('FATAL: unknown parameter %s in sweep grid' % key)
+        target[path[-1]] = value
+    # end time and schedules are derived from number of days and interval
+    cell['end'] = cell['start'] + cell['n_days'] * cell['order_sched']['interval']
+    rescale_schedules(params, cell)
+    return cell
+
+
+# All combinations of grid values as dicts of overrides
+def get_cells(grid):
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def get_cell_hash(params, seed, code_version):
+    key = json.dumps({'params': params, 'seed': seed, 'code': code_version}, sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+# Run one cell and write its results to path, atomically so that an interrupted cell is not cached
+def run_cell(params, seed, path, meta, warm_cache=None):
+    tmp_path = path + '.tmp'
+    with zipfile.ZipFile(tmp_path, 'w') as zip_file:
+        zip_file.writestr('params.json', json.dumps(meta, indent=2, sort_keys=True))
+        exp.run_experiment(params, seed, zip_file, draw_graphs=False, warm_cache=warm_cache)
+    os.replace(tmp_path, path)
+    return path
+
+
+def run_sweep(params, grid, seed, cache_dir, workers=1):
+    os.makedirs(cache_dir, exist_ok=True)
+    code_version = version.get_code_version()
+    warm_cache = os.path.join(cache_dir, 'warm')
+
+    rows = []
+    todo = []
+    for n, overrides in enumerate(get_cells(grid)):
+        cell_params = apply_overrides(params, overrides)
+        cell_hash = get_cell_hash(cell_params, seed, code_version)
+        path = os.path.join(cache_dir, cell_hash + '.zip')
+        cached = os.path.exists(path)
+        if not cached:
+            meta = {'params': cell_params, 'seed': seed, 'code': code_version, 'overrides': overrides}
+            todo.append((cell_params, seed, path, meta, warm_cache))
+        row = {'cell': n, 'hash': cell_hash, 'cached': cached, 'path': path}
+        row.update({k: json.dumps(v) for k, v in overrides.items()})
+        rows.append(row)
+
+    logger.info('%d cells, %d cached' % (len(rows), len(rows) - len(todo)))
+    if todo and workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            for path in executor.map(run_cell, *zip(*todo)):
+                logger.info('Finished %s' % path)
+    else:
+        for cell in todo:
+            logger.info('Finished %s' % run_cell(*cell))
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run an experiment over a grid of parameter overrides')
+    parser.add_argument('input_file', help='base experiment file')
+    parser.add_argument('grid_file', help='json file of parameter -> list of values')
+    parser.add_argument('--seed', type=int, required=True, help='master random seed for every cell')
+    parser.add_argument('--workers', type=int, default=1, help='number of cells to run in parallel')
+    parser.add_argument('--cache', default='sweep_cache', help='directory of cached cell results')
+    args = parser.parse_args()
+
+    filename, file_ext = os.path.splitext(os.path.basename(args.input_file))
+    with open(args.grid_file) as f:
+        sweep_grid = json.load(f)
+
+    sweep = run_sweep(expctl.get_params(args.input_file), sweep_grid, args.seed, args.cache, args.workers)
+    sweep.to_csv(filename + '_sweep.csv', index=False)
+    sys.exit('Complete')
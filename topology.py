@@ -0,0 +1,187 @@
+import os
+import sys
+import time
+import itertools
+import struct
+import zipfile
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Undirected network of traders with nodes 0..n-1, stored as an immutable compressed sparse row adjacency:
+# neighbours of node v are indices[indptr[v]:indptr[v + 1]], without duplicates or self loops. They are in the
+# networkx graph's adjacency order for networks built from a graph (the order counterparties have always been
+# matched in), sorted otherwise.
+# One Network is shared by the buyer and seller sides of a market. Networks are built from networkx graphs
+# (setup.build_network's generators), from edge lists, or loaded from .npz files written by save(), whose arrays
+# are memory-mapped rather than read into memory. networkx is only needed to generate and draw networks.
+# Edge lists can be converted to .npz once with
+#   python topology.py edges.txt network.npz
+
+
+class Network:
+    def __init__(self, indptr, indices, path=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.path = path  # file the network was loaded from, if any
+        self.n_nodes = len(indptr) - 1
+        for arr in (self.indptr, self.indices):
+            if arr.flags.writeable:
+                arr.flags.writeable = False
+
+    def __len__(self):
+        return self.n_nodes
+
+    # A network loaded from a file is pickled as its path, so it is memory-mapped again rather than copied
+    def __getstate__(self):
+        if self.path is not None:
+            return {'path': self.path}
+        return {'indptr': self.indptr, 'indices': self.indices}
+
+    def __setstate__(self, state):
+        if 'path' in state:
+            state = load(state['path']).__dict__
+        self.__init__(state['indptr'], state['indices'], state.get('path'))
+
+    def number_of_nodes(self):
+        return self.n_nodes
+
+    def number_of_edges(self):
+        return len(self.indices) // 2
+
+    def neighbors(self, v):
+        return self.indices[self.indptr[v]:self.indptr[v + 1]]
+
+    def degree(self, v):
+        return int(self.indptr[v + 1] - self.indptr[v])
+
+    def degrees(self):
+        return np.diff(self.indptr)
+
+    # Edges (u, v) with u < v as an (n_edges x 2) array
+    def edges(self):
+        src = np.repeat(np.arange(self.n_nodes), self.degrees())
+        upper = src < self.indices
+        return np.column_stack((src[upper], self.indices[upper]))
+
+    # Requires networkx
+    def to_networkx(self):
+        import networkx as nx
+        graph = nx.Graph()
+        graph.add_nodes_from(range(self.n_nodes))
+        graph.add_edges_from(self.edges().tolist())
+        return graph
+
+    # Save as an uncompressed .npz, which load() memory-maps
+    def save(self, path):
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, indptr=self.indptr, indices=self.indices)
+        os.replace(tmp_path, path)
+
+    # Adjacency list in the format of networkx.write_adjlist: each node followed by its neighbours with higher ids
+    def write_adjlist(self, f):
+        f.write(('#%s\n# GMT %s\n# \n' % (' '.join(sys.argv), time.asctime(time.gmtime()))).encode('utf-8'))
+        for v in range(self.n_nodes):
+            nbrs = self.neighbors(v)
+            nbrs = nbrs[nbrs > v]
+            f.write((' '.join(map(str, [v] + nbrs.tolist())) + '\n').encode('utf-8'))
+
+
+# Network from an (n_edges x 2) array of node ids, edges are undirected, duplicates and self loops are dropped.
+# Nodes are 0..n_nodes-1, n_nodes defaults to the highest node id + 1.
+def from_edges(edges, n_nodes=None):
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    if n_nodes is None:
+        n_nodes = int(edges.max()) + 1 if edges.size else 0
+    if edges.size and (edges.min() < 0 or edges.max() >= n_nodes):
+        sys.exit('FATAL: node ids in edge list outside 0..%d' % (n_nodes - 1))
+
+    src = np.concatenate((edges[:, 0], edges[:, 1]))
+    dst = np.concatenate((edges[:, 1], edges[:, 0]))
+    del edges
+    order = np.lexsort((dst, src))
+    src = src[order]
+    dst = dst[order]
+    del order
+    keep = np.ones(src.size, dtype=bool)
+    keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src[keep], minlength=n_nodes), out=indptr[1:])
+    return Network(indptr, dst[keep].astype(index_type(n_nodes)))
+
+
+# Row ids of both sides of the market (2 * n_nodes) must fit the index type
+def index_type(n_nodes):
+    return np.int32 if 2 * n_nodes < 2 ** 31 else np.int64
+
+
+# Network from a networkx graph with nodes 0..n-1, keeping each node's neighbours in the graph's adjacency order
+def from_networkx(graph):
+    n_nodes = graph.number_of_nodes()
+    adj = [[u for u in graph.adj[v] if u != v] for v in range(n_nodes)]
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum([len(nbrs) for nbrs in adj], out=indptr[1:])
+    indices = np.fromiter(itertools.chain.from_iterable(adj), dtype=index_type(n_nodes), count=int(indptr[-1]))
+    return Network(indptr, indices)
+
+
+# Arrays of an .npz file, members that are stored uncompressed are memory-mapped
+def load_npz(path):
+    arrays = {}
+    with zipfile.ZipFile(path) as zip_file, open(path, 'rb') as f:
+        for info in zip_file.infolist():
+            name = info.filename[:-len('.npy')]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with zip_file.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            # Array data follows the member's local file header and the .npy header
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_len, extra_len = struct.unpack('<HH', header[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                     order='F' if fortran_order else 'C')
+    return arrays
+
+
+# Edge list from a text file of whitespace separated node id pairs (lines starting with # are comments) or a .npy
+# file of an (n_edges x 2) array, which is memory-mapped
+def read_edges(path):
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    df = pd.read_csv(path, sep=r'\s+', comment='#', header=None, usecols=[0, 1], dtype=np.int64)
+    return df.to_numpy()
+
+
+# Network from a .npz file written by Network.save (memory-mapped) or an edge list file
+def load(path, n_nodes=None):
+    if not os.path.exists(path):
+        sys.exit('FATAL: network file %s does not exist' % path)
+    if path.endswith('.npz'):
+        arrays = load_npz(path)
+        if 'indptr' not in arrays or 'indices' not in arrays:
+            sys.exit('FATAL: network file %s has no indptr/indices arrays' % path)
+        return Network(arrays['indptr'], arrays['indices'], os.path.abspath(path))
+    return from_edges(read_edges(path), n_nodes)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert an edge list to a network file that is memory-mapped')
+    parser.add_argument('edges', help='edge list, text or .npy')
+    parser.add_argument('out', help='.npz file to write')
+    parser.add_argument('--nodes', type=int, default=None, help='number of nodes, default highest node id + 1')
+    args = parser.parse_args()
+
+    network = load(args.edges, args.nodes)
+    network.save(args.out)
+    print('%d nodes, %d edges written to %s' % (network.number_of_nodes(), network.number_of_edges(), args.out))
@@ -0,0 +1,15 @@
+import os
+import glob
+import hashlib
+
+# Version of the simulation code, part of the keys of cached sweep results and warm start snapshots and recorded
+# in benchmark results. Only imports the standard library, so any module can import it.
+
+
+# Hash of the simulation source code, so cached results are not reused after the code changes
+def get_code_version():
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import random
+import hashlib
+
+import numpy as np
+
+import data
+import setup
+import session
+import streams
+import version
+from population import TraderPopulation
+
+# Warm starts: ZIP traders start a trial from margins, learning rates and momentum they had after a burn-in run of
+# the same market, rather than from the random values drawn by setup.initialise_agent, so that trials skip the days
+# margins take to converge.
+# A snapshot is the (margin, beta, momentum, prev_change) of every trader at the end of the last burn-in day. It is
+# determined by the network, traders_spec, order schedule, ZIP update rules, clearing mode, number of burn-in days
+# and code version, which are hashed into its key, and the burn-in is seeded from the key, so a snapshot is the same
+# whether it is computed or read from the cache. Snapshots are cached as <key>.npz in a cache directory shared by
+# experiments.
+FIELDS = ('margin', 'beta', 'momentum', 'prev_change')
+
+
+# Hash of the CSR adjacency of a topology.Network
+def get_network_hash(network):
+    digest = hashlib.sha256()
+    for arr in (network.indptr, network.indices):
+        digest.update(np.ascontiguousarray(arr, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def get_key(params, buy_network, sell_network, days, code_version):
+    key = json.dumps({'network': params['network'],
+                      'buy_network': get_network_hash(buy_network),
+                      'sell_network': get_network_hash(sell_network),
+                      'traders_spec': params['traders_spec'],
+                      'order_sched': params['order_sched'],
+                      'zip_update': params['zip_update'],
+                      'update_scope': params['update_scope'],
+                      'clearing': params['clearing'],
+                      'days': days,
+                      'code': code_version}, sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+# Run the market for days days from scratch and return the traders' state at the end as a dict of arrays
+def burn_in(params, n_traders, buy_network, sell_network, days, seed):
+    random.seed(seed)
+    streams.reset()
+    traders = TraderPopulation(n_traders)
+    setup.populate_market(params['traders_spec'], traders, buy_network, sell_network, False)
+    ndat = data.init_ndat(params['traders_spec'], days)
+    end = params['start'] + days * params['order_sched']['interval']
+    session.run(0, params['start'], end, params['order_sched'], traders, n_traders, ndat, buy_network, sell_network,
+                params['zip_update'], params['update_scope'], clearing=params['clearing'])
+    snapshot = {name: getattr(traders, name).copy() for name in FIELDS}
+    snapshot['is_zip'] = traders.is_zip.copy()
+    return snapshot
+
+
+# Written to a temporary file and renamed into place, processes computing the same snapshot at once don't clash
+def save(path, snapshot, meta):
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, meta=np.array(json.dumps(meta, sort_keys=True)), **snapshot)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load(path):
+    with np.load(path) as f:
+        return {name: f[name] for name in FIELDS + ('is_zip',)}
+
+
+# Snapshot after days burn-in days of the market, from cache_dir if it has been computed before (None: always
+# computed, not cached)
+def get_snapshot(params, n_traders, buy_network, sell_network, days, cache_dir=None):
+    if days < 1:
+        sys.exit('FATAL: warm start needs at least 1 burn-in day, got %d' % days)
+    code_version = version.get_code_version()
+    key = get_key(params, buy_network, sell_network, days, code_version)
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, key + '.npz')
+        if os.path.exists(path):
+            return load(path)
+
+    snapshot = burn_in(params, n_traders, buy_network, sell_network, days, int(key[:16], 16))
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        save(path, snapshot, {'network': params['network'], 'traders_spec': params['traders_spec'],
+                              'order_sched': params['order_sched'], 'days': days, 'code': code_version})
+    return snapshot
+
+
+# perturb < 1 keeps buyers' margins negative and sellers' positive
+def check(snapshot, is_zip, perturb):
+    if not 0.0 <= perturb < 1.0:
+        sys.exit('FATAL: warm start perturbation must be in [0, 1), got %s' % perturb)
+    if not np.array_equal(is_zip, snapshot['is_zip']):
+        sys.exit('FATAL: warm start snapshot is for a different traders_spec')
+
+
+# Set the state of ZIP traders in a TraderPopulation from snapshot. With perturb > 0 each margin is multiplied by
+# a factor drawn uniformly from [1 - perturb, 1 + perturb) on the 'agents' stream, so trials do not all start
+# from the same margins.
+def apply(traders, snapshot, perturb=0.0):
+    check(snapshot, traders.is_zip, perturb)
+    rows = np.flatnonzero(traders.is_zip)
+    for name in FIELDS:
+        getattr(traders, name)[rows] = snapshot[name][rows]
+    if perturb > 0.0:
+        noise = streams.random_array(streams.get('agents'), rows.size)
+        traders.margin[rows] *= 1.0 + perturb * (2.0 * noise - 1.0)